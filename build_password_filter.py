@@ -0,0 +1,29 @@
+#Helper script that builds the leaked password Bloom filter used by is_valid_password from a plain wordlist.
+
+import argparse
+import time
+
+from password_filter import build_filter, filter_parameters
+
+def read_words(path: str):
+    """Yield non-empty lines of a wordlist (one password per line)"""
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            word = line.rstrip('\r\n')
+            if word:
+                yield word
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a Bloom filter of leaked passwords from a wordlist")
+    parser.add_argument('wordlist', help="text file, one password per line")
+    parser.add_argument('output', nargs='?', default='breached_passwords.bloom')
+    parser.add_argument('--fp', type=float, default=0.001, help="target false positive rate")
+    args = parser.parse_args()
+
+    # Первый проход - посчитать слова, чтобы подобрать размер фильтра
+    count = sum(1 for _ in read_words(args.wordlist))
+    bits, hashes = filter_parameters(count, args.fp)
+    started = time.perf_counter()
+    added = build_filter(read_words(args.wordlist), count, args.output, args.fp)
+    print(f"{added} passwords, {bits // 8 / 1024 / 1024:.1f} MiB, {hashes} hashes, "
+          f"built in {time.perf_counter() - started:.1f}s -> {args.output}")
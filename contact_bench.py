@@ -0,0 +1,57 @@
+#Helper script that compares contact validation with and without the input classifier (validator calls, DNS queries, time).
+
+import argparse
+import asyncio
+import time
+
+from contact_check import ContactValidator
+from email_check import StaticResolver, is_valid_email
+from phone import is_valid_phone
+
+def make_inputs(count: int) -> list:
+    """Mixed contact input: valid and mistyped phones, emails, and free text"""
+    kinds = [
+        lambda i: f'+38067{i % 10000000:07d}',           # номер
+        lambda i: f'067{i % 1000000:06d}',               # номер с пропущенной цифрой
+        lambda i: f'+38 067 {i % 1000:03d} 45 67',       # номер с пробелами
+        lambda i: f'user{i}@mail{i % 50}.example.org',   # email
+        lambda i: f'user{i}mail{i % 50}.example.org',    # email без @
+        lambda i: f'Иван {i}',                           # текст
+    ]
+    return [kinds[i % len(kinds)](i) for i in range(count)]
+
+async def run_sequential(inputs: list, resolver: StaticResolver) -> dict:
+    """The previous process_contact order: phone first, full email check whenever it fails"""
+    email_checks = 0
+    for contact in inputs:
+        is_valid, _ = is_valid_phone(contact)
+        if not is_valid:
+            email_checks += 1
+            await is_valid_email(contact, resolver=resolver)
+    return {'phone_checks': len(inputs), 'email_checks': email_checks}
+
+async def run_classified(inputs: list, resolver: StaticResolver) -> dict:
+    validator = ContactValidator(resolver=resolver)
+    for contact in inputs:
+        await validator.check(contact)
+    stats = validator.stats()
+    return {'phone_checks': stats['routed_phone'], 'email_checks': stats['routed_email'], **stats}
+
+async def measure(name: str, runner, inputs: list):
+    # Все домены mail*.example.org отвечают MX-записью
+    resolver = StaticResolver({(f'mail{i}.example.org', 'MX'): ['10 mx.example.org.'] for i in range(50)})
+    started = time.perf_counter()
+    counters = await runner(inputs, resolver)
+    elapsed = time.perf_counter() - started
+    print(f"{name}: {elapsed / len(inputs) * 1e6:.1f}us per input, DNS queries: {len(resolver.queries)}, {counters}")
+
+async def run(count: int):
+    inputs = make_inputs(count)
+    await measure("sequential", run_sequential, inputs)
+    await measure("classified", run_classified, inputs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark contact validation routing")
+    parser.add_argument('--inputs', type=int, default=6000)
+    args = parser.parse_args()
+    asyncio.run(run(args.inputs))
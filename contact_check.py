@@ -0,0 +1,73 @@
+#Secondary bot file that is responsible for contact input: a cheap classifier that sends it to exactly one validator.
+
+import re
+from typing import Dict, NamedTuple, Optional
+
+from email_check import DomainCache, is_valid_email
+from phone import PHONE_FORMAT_ERROR, is_valid_phone
+
+CONTACT_PHONE = 'phone'
+CONTACT_EMAIL = 'email'
+CONTACT_INVALID = 'invalid'
+
+# Похоже на номер: цифры с необязательным + и разделителями
+PHONE_CANDIDATE = re.compile(r'^\+?[\d\s()\-]+$')
+# Похоже на email: ровно одна @ и никаких пробелов; остальное проверит validate_email
+EMAIL_CANDIDATE = re.compile(r'^[^@\s]+@[^@\s]+$')
+
+EMAIL_FORMAT_ERROR = "Неверный формат email"
+
+class ContactCheck(NamedTuple):
+    """Verdict for contact input; the validator that was not run reports a format error"""
+    kind: str
+    is_valid: bool
+    phone_error: str
+    email_error: str
+
+def classify_contact(contact: str) -> str:
+    """Offline guess of what the input is meant to be: phone, email or neither"""
+    if PHONE_CANDIDATE.match(contact):
+        return CONTACT_PHONE
+    if EMAIL_CANDIDATE.match(contact):
+        return CONTACT_EMAIL
+    return CONTACT_INVALID
+
+class ContactValidator:
+    """Validates contact input with the one validator its shape calls for and counts skipped checks"""
+
+    def __init__(self, domain_cache: Optional[DomainCache] = None, resolver=None):
+        self.domain_cache = domain_cache
+        self.resolver = resolver
+        self.routed = {CONTACT_PHONE: 0, CONTACT_EMAIL: 0, CONTACT_INVALID: 0}
+        # Раньше email проверялся после каждой неудачной проверки телефона, а телефон - перед каждым email
+        self.email_checks_skipped = 0
+        self.phone_checks_skipped = 0
+
+    async def check(self, contact: str) -> ContactCheck:
+        """Classify the input, then run only the matching validator"""
+        kind = classify_contact(contact)
+        self.routed[kind] += 1
+
+        if kind == CONTACT_PHONE:
+            is_valid, phone_error = is_valid_phone(contact)
+            if not is_valid:
+                self.email_checks_skipped += 1
+            return ContactCheck(kind, is_valid, phone_error, EMAIL_FORMAT_ERROR)
+
+        if kind == CONTACT_EMAIL:
+            self.phone_checks_skipped += 1
+            # Синтаксис проверяется офлайн внутри is_valid_email, DNS - только после него
+            is_valid, email_error = await is_valid_email(contact, resolver=self.resolver, cache=self.domain_cache)
+            return ContactCheck(kind, is_valid, PHONE_FORMAT_ERROR, email_error)
+
+        self.email_checks_skipped += 1
+        self.phone_checks_skipped += 1
+        return ContactCheck(kind, False, PHONE_FORMAT_ERROR, EMAIL_FORMAT_ERROR)
+
+    def stats(self) -> Dict[str, int]:
+        """Return routing counters and the number of validator calls avoided"""
+        return {
+            **{f'routed_{kind}': count for kind, count in self.routed.items()},
+            'email_checks_skipped': self.email_checks_skipped,
+            'phone_checks_skipped': self.phone_checks_skipped,
+        }
@@ -1,147 +1,785 @@
-#Secondary bot file that is responsible for working with the database: loading, and so on. 
+#Secondary bot file that is responsible for working with the database: loading, and so on.
 
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
 import sqlite3
-from typing import Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from cache import MISSING, TTLCache
+from metrics import DB_QUERY_LATENCY, DB_QUEUE_WAIT
+from passwords import PasswordHasher, is_password_hash
+
+class UserStatus(NamedTuple):
+    """Registration and block flags of a user row"""
+    registration_complete: bool
+    is_blocked: bool
+
+    @property
+    def is_authorized(self) -> bool:
+        """Registered and not blocked, same rule as Database.check_auth"""
+        return self.registration_complete and not self.is_blocked
+
+class Delivery(NamedTuple):
+    """Verification code delivery claimed from the queue"""
+    delivery_id: int
+    telegram_id: int
+    channel: str
+    contact: str
+    code: str
+    attempts: int
+
+class CodeCheck(NamedTuple):
+    """Result of checking a verification code"""
+    status: str
+    attempts_left: int
+
+CODE_OK = 'ok'
+CODE_INVALID = 'invalid'
+# Кода нет: истек, удален уборщиком или еще не запрошен
+CODE_EXPIRED = 'expired'
+CODE_EXHAUSTED = 'exhausted'
+
+# Колонки users, которые разрешено менять через update_user_field(s)
+USER_FIELDS = frozenset({'name', 'contact', 'password'})
 
 class Database:
-    def __init__(self, db_file: str):
+    def __init__(self, db_file: str, cache_size_kib: int = 8192, mmap_size: int = 64 * 1024 * 1024,
+                 cached_statements: int = 64, status_cache_size: int = 10000,
+                 status_cache_ttl: float = 300.0, status_cache_negative_ttl: float = 30.0,
+                 last_login_flush_size: int = 500):
         self.db_file = db_file
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        # Одно долгоживущее соединение на поток вместо connect/close на каждый запрос
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # Кэш статусов (registration_complete, is_blocked); None - пользователя нет в базе
+        self.status_cache = TTLCache(
+            maxsize=status_cache_size,
+            ttl=status_cache_ttl,
+            negative_ttl=status_cache_negative_ttl
+        )
+
+        # Отложенная запись last_login: telegram_id -> время входа (UTC), пишется пачкой
+        self.last_login_flush_size = last_login_flush_size
+        self._pending_logins: Dict[int, str] = {}
+        self._pending_logins_lock = threading.Lock()
+
         self.create_tables()
-    
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection with tuned pragmas"""
+        conn = sqlite3.connect(
+            self.db_file,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Отрицательное значение cache_size задается в KiB, а не в страницах
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kib)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Return the persistent connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _cursor(self, commit: bool = False) -> Iterator[sqlite3.Cursor]:
+        """Yield a cursor on the thread connection, committing or rolling back on exit"""
+        conn = self.get_connection()
+        c = conn.cursor()
+        try:
+            yield c
+            if commit:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            c.close()
+
+    def close(self):
+        """Flush buffered writes and close all connections opened by this instance"""
+        self.flush_last_logins()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
     def create_tables(self):
         """Create necessary tables if they don't exist"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        # Create users table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                telegram_id INTEGER UNIQUE,
-                name TEXT,
-                contact TEXT,
-                password TEXT,
-                registration_complete BOOLEAN DEFAULT FALSE,
-                is_blocked BOOLEAN DEFAULT FALSE,
-                last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        with self._cursor(commit=True) as c:
+            # Create users table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    telegram_id INTEGER UNIQUE,
+                    name TEXT,
+                    contact TEXT,
+                    password TEXT,
+                    registration_complete BOOLEAN DEFAULT FALSE,
+                    is_blocked BOOLEAN DEFAULT FALSE,
+                    last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Очередь отправки кодов подтверждения; одна строка на поколение кода
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS verification_deliveries (
+                    delivery_id INTEGER PRIMARY KEY,
+                    telegram_id INTEGER NOT NULL,
+                    generation INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    contact TEXT NOT NULL,
+                    code TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    UNIQUE (telegram_id, generation)
+                )
+            ''')
+            c.execute('''
+                CREATE INDEX IF NOT EXISTS idx_verification_deliveries_due
+                ON verification_deliveries (status, next_attempt_at)
+            ''')
+
+            # Действующий код подтверждения пользователя: только хэш, срок жизни и счетчик попыток
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS verification_codes (
+                    telegram_id INTEGER PRIMARY KEY,
+                    code_hash TEXT NOT NULL,
+                    contact TEXT NOT NULL,
+                    generation INTEGER NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            c.execute('''
+                CREATE INDEX IF NOT EXISTS idx_verification_codes_expires_at
+                ON verification_codes (expires_at)
+            ''')
+
+            # Секреты приложения, общие для всех процессов бота
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS app_secrets (
+                    name TEXT PRIMARY KEY,
+                    value BLOB NOT NULL
+                )
+            ''')
+            c.execute(
+                'INSERT OR IGNORE INTO app_secrets (name, value) VALUES (?, ?)',
+                ('verification_code', secrets.token_bytes(32))
             )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
+            c.execute('SELECT value FROM app_secrets WHERE name = ?', ('verification_code',))
+            # Ключ HMAC: 6-значный код без ключа перебирается по хэшу за доли секунды
+            self._code_key = c.fetchone()[0]
+
+    def _read_status(self, telegram_id: int) -> Optional[UserStatus]:
+        """Return cached user status, loading it from the database on a miss"""
+        status = self.status_cache.get(telegram_id)
+        if status is not MISSING:
+            return status
+        return self.load_status(telegram_id)
+
+    def load_status(self, telegram_id: int) -> Optional[UserStatus]:
+        """Load user status from the database into the cache, without looking the cache up first"""
+        with self._cursor() as c:
+            c.execute('''
+                SELECT registration_complete, is_blocked
+                FROM users
+                WHERE telegram_id = ?
+            ''', (telegram_id,))
+            result = c.fetchone()
+
+        status = UserStatus(bool(result[0]), bool(result[1])) if result else None
+        self.status_cache.set(telegram_id, status)
+        return status
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Return status cache hit/miss/eviction counters"""
+        return self.status_cache.stats()
+
     def user_exists(self, telegram_id: int) -> bool:
         """Check if user exists and has completed registration"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('SELECT registration_complete FROM users WHERE telegram_id = ?', (telegram_id,))
-        result = c.fetchone()
-        
-        conn.close()
-        return result is not None and result[0]
-    
+        status = self._read_status(telegram_id)
+        return status is not None and status.registration_complete
+
     def get_user_data(self, telegram_id: int) -> Optional[Tuple]:
         """Get user registration data"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('SELECT name, contact, password FROM users WHERE telegram_id = ?', (telegram_id,))
-        result = c.fetchone()
-        
-        conn.close()
-        return result
-    
+        with self._cursor() as c:
+            c.execute('SELECT name, contact, password FROM users WHERE telegram_id = ?', (telegram_id,))
+            return c.fetchone()
+
+    def get_password_hash(self, telegram_id: int) -> Optional[str]:
+        """Get stored password hash (None if the user has no password yet)"""
+        with self._cursor() as c:
+            c.execute('SELECT password FROM users WHERE telegram_id = ?', (telegram_id,))
+            row = c.fetchone()
+            return row[0] if row else None
+
     def create_user(self, telegram_id: int):
         """Create new user entry"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('INSERT OR IGNORE INTO users (telegram_id) VALUES (?)', (telegram_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._cursor(commit=True) as c:
+            c.execute('INSERT OR IGNORE INTO users (telegram_id) VALUES (?)', (telegram_id,))
+
+        # Сбрасываем возможную отрицательную запись
+        self.status_cache.invalidate(telegram_id)
+
+    def get_user_status(self, telegram_id: int) -> UserStatus:
+        """Create user entry if missing and return its status in one statement"""
+        # Закэшированный статус означает, что строка уже есть - upsert не нужен
+        status = self.status_cache.get(telegram_id)
+        if status is not MISSING and status is not None:
+            return status
+        return self.upsert_status(telegram_id)
+
+    def upsert_status(self, telegram_id: int) -> UserStatus:
+        """Create user entry if missing and cache its status, without looking the cache up first"""
+        with self._cursor(commit=True) as c:
+            # DO UPDATE (а не DO NOTHING), чтобы RETURNING вернул и уже существующую строку
+            c.execute('''
+                INSERT INTO users (telegram_id) VALUES (?)
+                ON CONFLICT (telegram_id) DO UPDATE SET telegram_id = excluded.telegram_id
+                RETURNING registration_complete, is_blocked
+            ''', (telegram_id,))
+            registration_complete, is_blocked = c.fetchone()
+
+        status = UserStatus(bool(registration_complete), bool(is_blocked))
+        self.status_cache.set(telegram_id, status)
+        return status
+
     def update_user_field(self, telegram_id: int, field: str, value: str):
         """Update specific user field"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        query = f'UPDATE users SET {field} = ? WHERE telegram_id = ?'
-        c.execute(query, (value, telegram_id))
-        
-        conn.commit()
-        conn.close()
-    
+        self.update_user_fields(telegram_id, **{field: value})
+
+    def update_user_fields(self, telegram_id: int, **fields: str):
+        """Update several whitelisted user fields in one statement"""
+        unknown = set(fields) - USER_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown user fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+
+        # Сортируем имена колонок, чтобы один и тот же набор полей давал один и тот же
+        # текст запроса и попадал в кэш подготовленных выражений
+        columns = sorted(fields)
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        with self._cursor(commit=True) as c:
+            c.execute(
+                f'UPDATE users SET {assignments} WHERE telegram_id = ?',
+                (*(fields[column] for column in columns), telegram_id)
+            )
+
+    def finalize_registration(self, telegram_id: int, name: str, contact: str, password_hash: str):
+        """Save registration data and mark registration as complete in one transaction"""
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE users
+                SET name = ?,
+                    contact = ?,
+                    password = ?,
+                    registration_complete = TRUE,
+                    last_login = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+            ''', (name, contact, password_hash, telegram_id))
+            c.execute('DELETE FROM verification_codes WHERE telegram_id = ?', (telegram_id,))
+
+        self._mark_registered(telegram_id)
+
     def complete_registration(self, telegram_id: int):
         """Mark user registration as complete and update last login"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''
-            UPDATE users 
-            SET registration_complete = TRUE, 
-                last_login = CURRENT_TIMESTAMP 
-            WHERE telegram_id = ?
-        ''', (telegram_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE users
+                SET registration_complete = TRUE,
+                    last_login = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+            ''', (telegram_id,))
+
+        self._mark_registered(telegram_id)
+
+    def _mark_registered(self, telegram_id: int):
+        """Write-through registration flag into the status cache"""
+        self.status_cache.update(
+            telegram_id,
+            lambda status: status and status._replace(registration_complete=True)
+        )
+
     def update_last_login(self, telegram_id: int):
-        """Update user's last login timestamp"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''
-            UPDATE users 
-            SET last_login = CURRENT_TIMESTAMP 
-            WHERE telegram_id = ?
-        ''', (telegram_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        """Update user's last login timestamp (buffered, see flush_last_logins)"""
+        if self.buffer_last_login(telegram_id) >= self.last_login_flush_size:
+            self.flush_last_logins()
+
+    def buffer_last_login(self, telegram_id: int) -> int:
+        """Remember login time in memory and return the number of buffered users"""
+        # Тот же формат, что и у CURRENT_TIMESTAMP в SQLite
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        with self._pending_logins_lock:
+            self._pending_logins[telegram_id] = timestamp
+            return len(self._pending_logins)
+
+    def flush_last_logins(self) -> int:
+        """Write all buffered login timestamps in a single transaction"""
+        with self._pending_logins_lock:
+            pending, self._pending_logins = self._pending_logins, {}
+        if not pending:
+            return 0
+
+        try:
+            with self._cursor(commit=True) as c:
+                c.executemany(
+                    'UPDATE users SET last_login = ? WHERE telegram_id = ?',
+                    [(timestamp, telegram_id) for telegram_id, timestamp in pending.items()]
+                )
+        except sqlite3.Error:
+            # Возвращаем записи в буфер, не затирая более свежие входы
+            with self._pending_logins_lock:
+                for telegram_id, timestamp in pending.items():
+                    self._pending_logins.setdefault(telegram_id, timestamp)
+            raise
+        return len(pending)
+
+    def claim_due_deliveries(self, channel: str, now: float, lease: float, limit: int,
+                             shard_index: int = 0, shard_count: int = 1) -> List[Delivery]:
+        """Lease due deliveries of one channel for sending; unfinished leases become due again when they expire
+
+        Only rows of users owned by the shard are claimed (same rule as sharding.shard_for).
+        """
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE verification_deliveries
+                SET status = 'sending', next_attempt_at = ?
+                WHERE delivery_id IN (
+                    SELECT delivery_id FROM verification_deliveries
+                    WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? AND channel = ?
+                        AND (telegram_id % ? + ?) % ? = ?
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING delivery_id, telegram_id, channel, contact, code, attempts
+            ''', (now + lease, now, channel, shard_count, shard_count, shard_count, shard_index, limit))
+            return [Delivery(*row) for row in c.fetchall()]
+
+    def next_delivery_due_at(self, channel: str, shard_index: int = 0, shard_count: int = 1) -> Optional[float]:
+        """Return the earliest next_attempt_at among unfinished deliveries of the channel and shard"""
+        with self._cursor() as c:
+            # Остаток приводится к неотрицательному, как % в Python
+            c.execute('''
+                SELECT MIN(next_attempt_at) FROM verification_deliveries
+                WHERE status IN ('pending', 'sending') AND channel = ? AND (telegram_id % ? + ?) % ? = ?
+            ''', (channel, shard_count, shard_count, shard_count, shard_index))
+            return c.fetchone()[0]
+
+    def complete_delivery(self, delivery_id: int):
+        """Mark delivery as sent and forget the plain code"""
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE verification_deliveries
+                SET status = 'sent', code = NULL, attempts = attempts + 1, last_error = NULL
+                WHERE delivery_id = ?
+            ''', (delivery_id,))
+
+    def retry_delivery(self, delivery_id: int, next_attempt_at: float, error: str):
+        """Schedule another attempt after a failed one"""
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE verification_deliveries
+                SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE delivery_id = ?
+            ''', (next_attempt_at, error, delivery_id))
+
+    def fail_delivery(self, delivery_id: int, error: str):
+        """Give up on a delivery and forget the plain code"""
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE verification_deliveries
+                SET status = 'failed', code = NULL, attempts = attempts + 1, last_error = ?
+                WHERE delivery_id = ?
+            ''', (error, delivery_id))
+
+    def _code_hash(self, telegram_id: int, code: str) -> str:
+        return hmac.new(self._code_key, f'{telegram_id}:{code}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def store_verification_code(self, telegram_id: int, contact: str, code: str, channel: str,
+                                now: float, expires_at: float) -> Optional[int]:
+        """Store a new code and queue its delivery in one transaction; returns its generation
+
+        A live code for the same contact is kept and nothing is queued (None is returned), so
+        repeated or concurrent "Готово" clicks cannot replace the code that was already sent.
+        """
+        with self._cursor(commit=True) as c:
+            # Поколение продолжает нумерацию очереди отправки, чтобы новый код не совпал со старой доставкой
+            c.execute('''
+                INSERT INTO verification_codes (telegram_id, code_hash, contact, generation, attempts, expires_at)
+                VALUES (:id, :hash, :contact, COALESCE(
+                    (SELECT MAX(generation) FROM verification_deliveries WHERE telegram_id = :id), 0
+                ) + 1, 0, :expires_at)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    code_hash = excluded.code_hash,
+                    contact = excluded.contact,
+                    generation = excluded.generation,
+                    attempts = 0,
+                    expires_at = excluded.expires_at
+                WHERE verification_codes.expires_at <= :now OR verification_codes.contact != excluded.contact
+                RETURNING generation
+            ''', {'id': telegram_id, 'hash': self._code_hash(telegram_id, code), 'contact': contact,
+                  'expires_at': expires_at, 'now': now})
+            row = c.fetchone()
+            if row is None:
+                return None
+
+            generation = row[0]
+            c.execute('''
+                INSERT INTO verification_deliveries
+                    (telegram_id, generation, channel, contact, code, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (telegram_id, generation, channel, contact, code, now))
+            return generation
+
+    def check_verification_code(self, telegram_id: int, code: str, now: float, max_attempts: int) -> CodeCheck:
+        """Check a code and count a failed attempt with one indexed UPDATE ... RETURNING"""
+        with self._cursor(commit=True) as c:
+            # Попытка засчитывается при неверном живом коде; при исчерпанных попытках счетчик
+            # растет дальше, поэтому attempts > max_attempts однозначно значит "попытки кончились"
+            c.execute('''
+                UPDATE verification_codes
+                SET attempts = attempts + (attempts >= :max OR (code_hash != :hash AND expires_at > :now))
+                WHERE telegram_id = :id
+                RETURNING code_hash = :hash, expires_at > :now, attempts
+            ''', {'id': telegram_id, 'hash': self._code_hash(telegram_id, code), 'now': now, 'max': max_attempts})
+            row = c.fetchone()
+
+        if row is None:
+            return CodeCheck(CODE_EXPIRED, 0)
+        matches, is_alive, attempts = row
+        if attempts > max_attempts:
+            return CodeCheck(CODE_EXHAUSTED, 0)
+        if not is_alive:
+            return CodeCheck(CODE_EXPIRED, max_attempts - attempts)
+        if matches:
+            return CodeCheck(CODE_OK, max_attempts - attempts)
+        return CodeCheck(CODE_INVALID, max_attempts - attempts)
+
+    def delete_verification_code(self, telegram_id: int):
+        """Forget the user's code"""
+        with self._cursor(commit=True) as c:
+            c.execute('DELETE FROM verification_codes WHERE telegram_id = ?', (telegram_id,))
+
+    def delete_expired_codes(self, now: float, limit: int) -> int:
+        """Delete up to limit expired codes (by the expires_at index); returns the number deleted"""
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                DELETE FROM verification_codes
+                WHERE telegram_id IN (
+                    SELECT telegram_id FROM verification_codes
+                    WHERE expires_at <= ?
+                    LIMIT ?
+                )
+            ''', (now, limit))
+            return c.rowcount
+
+    def delete_finished_deliveries(self, before: float, limit: int) -> int:
+        """Delete up to limit sent or failed deliveries that finished before the given time
+
+        A finished row keeps next_attempt_at of its last lease, so that is its finish time
+        (at most one lease later) and the due index serves the lookup.
+        """
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                DELETE FROM verification_deliveries
+                WHERE delivery_id IN (
+                    SELECT delivery_id FROM verification_deliveries
+                    WHERE status IN ('sent', 'failed') AND next_attempt_at <= ?
+                    LIMIT ?
+                )
+            ''', (before, limit))
+            return c.rowcount
+
     def check_auth(self, telegram_id: int) -> bool:
         """Check if user is registered and not blocked"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''
-            SELECT registration_complete, is_blocked 
-            FROM users 
-            WHERE telegram_id = ?
-        ''', (telegram_id,))
-        
-        result = c.fetchone()
-        conn.close()
-        
-        if result:
-            is_registered, is_blocked = result
-            return is_registered and not is_blocked
-        return False
-    
+        status = self._read_status(telegram_id)
+        return status is not None and status.is_authorized
+
     def block_user(self, telegram_id: int):
         """Block user by setting is_blocked flag"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''
-            UPDATE users 
-            SET is_blocked = TRUE 
-            WHERE telegram_id = ?
-        ''', (telegram_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._cursor(commit=True) as c:
+            c.execute('''
+                UPDATE users
+                SET is_blocked = TRUE
+                WHERE telegram_id = ?
+            ''', (telegram_id,))
+
+        self.status_cache.update(telegram_id, lambda status: status and status._replace(is_blocked=True))
+
     def is_blocked(self, telegram_id: int) -> bool:
         """Check if user is blocked"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('SELECT is_blocked FROM users WHERE telegram_id = ?', (telegram_id,))
-        result = c.fetchone()
-        
-        conn.close()
-        return bool(result and result[0]) 
+        status = self._read_status(telegram_id)
+        return status is not None and status.is_blocked
+
+
+def _method_name(func) -> str:
+    # partial (вызовы с именованными аргументами) не имеет __name__ - берем имя обернутого метода
+    while isinstance(func, partial):
+        func = func.func
+    return getattr(func, '__name__', 'unknown')
+
+def _timed_call(submitted: float, func, *args):
+    # Выполняется в потоке базы: ожидание в очереди и время самого запроса считаются отдельно
+    name = _method_name(func)
+    started = time.perf_counter()
+    DB_QUEUE_WAIT.observe(started - submitted)
+    try:
+        return func(*args)
+    finally:
+        DB_QUERY_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class AsyncDatabase:
+    """Awaitable Database facade: every call runs on one dedicated database thread"""
+
+    def __init__(self, db_file: str, last_login_flush_interval: float = 5.0,
+                 password_hasher: Optional[PasswordHasher] = None,
+                 code_sweep_interval: float = 60.0, code_sweep_batch_size: int = 500,
+                 delivery_retention: float = 86400.0, **kwargs):
+        # Один поток-исполнитель = одна очередь запросов и одно соединение SQLite
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        self._db = self._executor.submit(Database, db_file, **kwargs).result()
+        # Хэширование паролей идет в пуле процессов, а не в потоке базы
+        self.password_hasher = password_hasher or PasswordHasher()
+        self.last_login_flush_interval = last_login_flush_interval
+        self._flush_task: Optional[asyncio.Task] = None
+        self.code_sweep_interval = code_sweep_interval
+        self.code_sweep_batch_size = code_sweep_batch_size
+        # Завершенные отправки (с контактом пользователя) храним для разбора не дольше этого срока
+        self.delivery_retention = delivery_retention
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.expired_codes_deleted = 0
+        self.finished_deliveries_deleted = 0
+
+    def start_background_tasks(self):
+        """Start periodic flushing of buffered writes and expired code sweeping on the running loop"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_periodically())
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.code_sweep_interval)
+            try:
+                await self.sweep_expired_codes()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to delete expired verification codes and deliveries: {e}")
+
+    async def _delete_in_batches(self, delete, before: float) -> int:
+        # Пачками, чтобы между ними проходили другие запросы
+        total = 0
+        while True:
+            deleted = await self._run(delete, before, self.code_sweep_batch_size)
+            total += deleted
+            if deleted < self.code_sweep_batch_size:
+                return total
+
+    async def sweep_expired_codes(self) -> int:
+        """Delete expired codes and deliveries finished longer than delivery_retention ago
+
+        Returns the number of codes deleted; deliveries are counted in finished_deliveries_deleted.
+        """
+        now = time.time()
+        total = await self._delete_in_batches(self._db.delete_expired_codes, now)
+        self.expired_codes_deleted += total
+        self.finished_deliveries_deleted += await self._delete_in_batches(
+            self._db.delete_finished_deliveries, now - self.delivery_retention
+        )
+        return total
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.last_login_flush_interval)
+            try:
+                await self.flush_last_logins()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to flush last login timestamps: {e}")
+
+    @property
+    def db_file(self) -> str:
+        return self._db.db_file
+
+    async def _run(self, func, *args):
+        """Run a blocking Database method on the database thread, recording queue wait and run time"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(_timed_call, time.perf_counter(), func, *args))
+
+    async def user_exists(self, telegram_id: int) -> bool:
+        """Check if user exists and has completed registration"""
+        return await self._run(self._db.user_exists, telegram_id)
+
+    async def get_user_data(self, telegram_id: int) -> Optional[Tuple]:
+        """Get user registration data"""
+        return await self._run(self._db.get_user_data, telegram_id)
+
+    async def verify_password(self, telegram_id: int, password: str) -> bool:
+        """Check a user's password in the hashing pool, upgrading outdated hashes on success"""
+        stored = await self._run(self._db.get_password_hash, telegram_id)
+        if not stored:
+            return False
+
+        if is_password_hash(stored):
+            is_valid = await self.password_hasher.verify(password, stored)
+        else:
+            # Пароль, сохраненный до введения хэширования
+            is_valid = hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+
+        if is_valid and self.password_hasher.needs_rehash(stored):
+            password_hash = await self.password_hasher.hash(password)
+            await self._run(self._db.update_user_field, telegram_id, 'password', password_hash)
+        return is_valid
+
+    async def create_user(self, telegram_id: int):
+        """Create new user entry"""
+        await self._run(self._db.create_user, telegram_id)
+
+    def _cached_status(self, telegram_id: int):
+        # Кэш статусов потокобезопасен; попадание отдаем сразу, без перехода в поток базы
+        # (переход стоит миллисекунды из-за передачи GIL под нагрузкой, сам запрос - микросекунды).
+        # Промах уже посчитан здесь, поэтому в потоке базы кэш повторно не проверяем
+        return self._db.status_cache.get(telegram_id)
+
+    async def get_user_status(self, telegram_id: int) -> UserStatus:
+        """Create user entry if missing and return its status in one statement"""
+        status = self._cached_status(telegram_id)
+        if status is not MISSING and status is not None:
+            return status
+        return await self._run(self._db.upsert_status, telegram_id)
+
+    async def update_user_field(self, telegram_id: int, field: str, value: str):
+        """Update specific user field"""
+        await self._run(self._db.update_user_field, telegram_id, field, value)
+
+    async def update_user_fields(self, telegram_id: int, **fields: str):
+        """Update several whitelisted user fields in one statement"""
+        await self._run(partial(self._db.update_user_fields, telegram_id, **fields))
+
+    async def finalize_registration(self, telegram_id: int, name: str, contact: str, password_hash: str):
+        """Save registration data and mark registration as complete in one transaction"""
+        await self._run(self._db.finalize_registration, telegram_id, name, contact, password_hash)
+
+    async def complete_registration(self, telegram_id: int):
+        """Mark user registration as complete and update last login"""
+        await self._run(self._db.complete_registration, telegram_id)
+
+    async def update_last_login(self, telegram_id: int):
+        """Update user's last login timestamp (buffered, see flush_last_logins)"""
+        # Буферизация - просто запись в словарь, в поток базы идем только за сбросом
+        if self._db.buffer_last_login(telegram_id) >= self._db.last_login_flush_size:
+            await self.flush_last_logins()
+
+    async def flush_last_logins(self) -> int:
+        """Write all buffered login timestamps in a single transaction"""
+        return await self._run(self._db.flush_last_logins)
+
+    async def claim_due_deliveries(self, channel: str, now: float, lease: float, limit: int,
+                                   shard_index: int = 0, shard_count: int = 1) -> List[Delivery]:
+        """Lease due deliveries of one channel for the shard's users"""
+        return await self._run(self._db.claim_due_deliveries, channel, now, lease, limit, shard_index, shard_count)
+
+    async def next_delivery_due_at(self, channel: str, shard_index: int = 0, shard_count: int = 1) -> Optional[float]:
+        """Return the earliest next_attempt_at among unfinished deliveries of the channel and shard"""
+        return await self._run(self._db.next_delivery_due_at, channel, shard_index, shard_count)
+
+    async def complete_delivery(self, delivery_id: int):
+        """Mark delivery as sent and forget the plain code"""
+        await self._run(self._db.complete_delivery, delivery_id)
+
+    async def retry_delivery(self, delivery_id: int, next_attempt_at: float, error: str):
+        """Schedule another attempt after a failed one"""
+        await self._run(self._db.retry_delivery, delivery_id, next_attempt_at, error)
+
+    async def fail_delivery(self, delivery_id: int, error: str):
+        """Give up on a delivery and forget the plain code"""
+        await self._run(self._db.fail_delivery, delivery_id, error)
+
+    async def store_verification_code(self, telegram_id: int, contact: str, code: str, channel: str,
+                                      now: float, expires_at: float) -> Optional[int]:
+        """Store a new code and queue its delivery unless a live code for the contact exists"""
+        return await self._run(self._db.store_verification_code, telegram_id, contact, code, channel, now, expires_at)
+
+    async def check_verification_code(self, telegram_id: int, code: str, now: float, max_attempts: int) -> CodeCheck:
+        """Check a code and count a failed attempt with one indexed statement"""
+        return await self._run(self._db.check_verification_code, telegram_id, code, now, max_attempts)
+
+    async def delete_verification_code(self, telegram_id: int):
+        """Forget the user's code"""
+        await self._run(self._db.delete_verification_code, telegram_id)
+
+    async def check_auth(self, telegram_id: int) -> bool:
+        """Check if user is registered and not blocked"""
+        status = self._cached_status(telegram_id)
+        if status is not MISSING:
+            return status is not None and status.is_authorized
+        status = await self._run(self._db.load_status, telegram_id)
+        return status is not None and status.is_authorized
+
+    async def block_user(self, telegram_id: int):
+        """Block user by setting is_blocked flag"""
+        await self._run(self._db.block_user, telegram_id)
+
+    async def is_blocked(self, telegram_id: int) -> bool:
+        """Check if user is blocked"""
+        status = self._cached_status(telegram_id)
+        if status is not MISSING:
+            return status is not None and status.is_blocked
+        status = await self._run(self._db.load_status, telegram_id)
+        return status is not None and status.is_blocked
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Return status cache hit/miss/eviction counters"""
+        return self._db.cache_stats()
+
+    async def close(self):
+        """Flush buffered writes, close the connection and stop the database thread and hashing pool"""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        self.password_hasher.close()
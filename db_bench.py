@@ -0,0 +1,83 @@
+#Helper script that compares per-call latency of connect-per-call SQLite access with Database's persistent connections.
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from database import Database
+
+def legacy_setup(db_file: str, users: int):
+    """Create the users table the way the old Database did (default journal, connect per call)"""
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            telegram_id INTEGER UNIQUE,
+            name TEXT,
+            contact TEXT,
+            password TEXT,
+            registration_complete BOOLEAN DEFAULT FALSE,
+            is_blocked BOOLEAN DEFAULT FALSE,
+            last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO users (telegram_id) VALUES (?)', ((i,) for i in range(users)))
+    conn.commit()
+    conn.close()
+
+def legacy_read(db_file: str, telegram_id: int):
+    # Так выглядел каждый запрос до постоянных соединений
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.execute('SELECT name, contact, password FROM users WHERE telegram_id = ?', (telegram_id,))
+    result = c.fetchone()
+    conn.close()
+    return result
+
+def legacy_write(db_file: str, telegram_id: int, value: str):
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.execute('UPDATE users SET name = ? WHERE telegram_id = ?', (value, telegram_id))
+    conn.commit()
+    conn.close()
+
+def measure(call, calls: int) -> list:
+    """Return per-call latencies in microseconds"""
+    latencies = []
+    for i in range(calls):
+        started = time.perf_counter()
+        call(i)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+def report(label: str, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<28} mean {statistics.fmean(latencies):7.1f}us  p50 {latencies[len(latencies) // 2]:7.1f}us  p99 {p99:7.1f}us")
+
+def run(reads: int, writes: int, users: int):
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_file = os.path.join(directory, 'legacy.db')
+        legacy_setup(legacy_file, users)
+        report("connect per call, read", measure(lambda i: legacy_read(legacy_file, i % users), reads))
+        report("connect per call, write", measure(lambda i: legacy_write(legacy_file, i % users, f'user{i}'), writes))
+
+        db = Database(os.path.join(directory, 'persistent.db'))
+        for telegram_id in range(users):
+            db.create_user(telegram_id)
+        report("persistent, read", measure(lambda i: db.get_user_data(i % users), reads))
+        report("persistent, write", measure(lambda i: db.update_user_field(i % users, 'name', f'user{i}'), writes))
+        # check_auth дополнительно идет через кэш статусов
+        report("persistent, check_auth", measure(lambda i: db.check_auth(i % users), reads))
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare connect-per-call and persistent SQLite connections")
+    parser.add_argument('--reads', type=int, default=5000)
+    parser.add_argument('--writes', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.reads, args.writes, args.users)
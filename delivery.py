@@ -0,0 +1,192 @@
+#Secondary bot file that is responsible for delivering verification codes in the background: persistent queue, retries and rate limits.
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from database import AsyncDatabase, Delivery
+from rate_limit import TokenBucket
+from verification import Verification
+
+CHANNEL_EMAIL = 'email'
+CHANNEL_SMS = 'sms'
+
+# Лимиты провайдеров по умолчанию: (сообщений в секунду, размер всплеска)
+DEFAULT_RATES = {
+    CHANNEL_EMAIL: (5.0, 10.0),
+    CHANNEL_SMS: (1.0, 5.0),
+}
+
+class DeliveryService:
+    """Drains the verification_deliveries queue with per-provider rate limits and backoff retries"""
+
+    def __init__(self, db: AsyncDatabase, verification: Verification,
+                 on_failed: Optional[Callable[[int], Awaitable[None]]] = None,
+                 max_attempts: int = 5, base_delay: float = 2.0, max_delay: float = 300.0,
+                 lease: float = 300.0, batch_size: int = 20, workers_per_channel: int = 2,
+                 idle_poll_interval: float = 30.0, rates: Optional[Dict[str, tuple]] = None):
+        self.db = db
+        self.verification = verification
+        self.on_failed = on_failed
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.batch_size = batch_size
+        self.workers_per_channel = workers_per_channel
+        self.idle_poll_interval = idle_poll_interval
+
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.buckets = {channel: TokenBucket(rate, burst) for channel, (rate, burst) in self.rates.items()}
+        # В шардированном режиме каждый воркер отправляет коды только своих пользователей
+        self.shard_index = 0
+        self.shard_count = 1
+        self.senders = {
+            CHANNEL_EMAIL: verification.send_email_code,
+            CHANNEL_SMS: verification.send_sms_code,
+        }
+
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: "list[asyncio.Task]" = []
+        # Свой опрашивающий цикл на канал: медленный SMS-лимит не задерживает email
+        self._pollers: "list[asyncio.Task]" = []
+        self._wakeups: Dict[str, asyncio.Event] = {}
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.deduplicated = 0
+
+    @staticmethod
+    def channel_for(contact: str) -> str:
+        return CHANNEL_EMAIL if '@' in contact else CHANNEL_SMS
+
+    async def send_code(self, telegram_id: int, contact: str, code: str, expires_at: float) -> bool:
+        """Store the code and queue it for sending; False if a live code for the contact was already sent"""
+        channel = self.channel_for(contact)
+        generation = await self.db.store_verification_code(telegram_id, contact, code, channel, time.time(), expires_at)
+        if generation is None:
+            self.deduplicated += 1
+        elif channel in self._wakeups:
+            self._wakeups[channel].set()
+        return generation is not None
+
+    def start(self, shard_index: Optional[int] = None, shard_count: int = 1):
+        """Start the queue poller and sender workers on the running loop
+
+        In sharded mode pass the worker's index and the number of workers: the worker
+        then sends only codes of the chats it owns (its FSM cache stays the only writer
+        for them) and gets 1/shard_count of each provider limit, so the total stays the same.
+        """
+        if self._pollers:
+            return
+        if shard_index is not None and shard_count > 1:
+            self.shard_index = shard_index
+            self.shard_count = shard_count
+            self.buckets = {
+                channel: TokenBucket(rate / shard_count, max(1.0, burst / shard_count))
+                for channel, (rate, burst) in self.rates.items()
+            }
+        for channel in self.senders:
+            # Маленькая локальная очередь, чтобы арендованные записи не ждали дольше аренды
+            self._queues[channel] = asyncio.Queue(maxsize=self.workers_per_channel)
+            self._wakeups[channel] = asyncio.Event()
+            for _ in range(self.workers_per_channel):
+                self._tasks.append(asyncio.create_task(self._worker(channel)))
+            self._pollers.append(asyncio.create_task(self._poll(channel)))
+
+    async def _poll(self, channel: str):
+        queue = self._queues[channel]
+        wakeup = self._wakeups[channel]
+        while True:
+            try:
+                deliveries = await self.db.claim_due_deliveries(
+                    channel, time.time(), self.lease, self.batch_size, self.shard_index, self.shard_count
+                )
+                for delivery in deliveries:
+                    await queue.put(delivery)
+                if deliveries:
+                    continue
+
+                due_at = await self.db.next_delivery_due_at(channel, self.shard_index, self.shard_count)
+            except Exception as e:
+                logging.error(f"Error polling {channel} verification delivery queue: {e}")
+                due_at = None
+
+            timeout = self.idle_poll_interval
+            if due_at is not None:
+                timeout = max(0.0, min(due_at - time.time(), timeout))
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+    async def _worker(self, channel: str):
+        queue = self._queues[channel]
+        while True:
+            delivery = await queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                logging.error(f"Error delivering verification code {delivery.delivery_id}: {e}")
+            finally:
+                queue.task_done()
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter for the given number of failed attempts"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, delivery: Delivery):
+        await self.buckets[delivery.channel].acquire()
+        success = False
+        if delivery.code is not None:
+            success = await self.senders[delivery.channel](delivery.contact, delivery.code)
+
+        if success:
+            await self.db.complete_delivery(delivery.delivery_id)
+            self.sent += 1
+            return
+
+        attempts = delivery.attempts + 1
+        if delivery.code is None or attempts >= self.max_attempts:
+            await self.db.fail_delivery(delivery.delivery_id, "send failed")
+            self.failed += 1
+            if self.on_failed is not None:
+                await self.on_failed(delivery.telegram_id)
+        else:
+            await self.db.retry_delivery(delivery.delivery_id, time.time() + self._backoff(attempts), "send failed")
+            self.retried += 1
+            self._wakeups[delivery.channel].set()
+
+    def stats(self) -> Dict[str, int]:
+        """Return delivery counters"""
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'deduplicated': self.deduplicated,
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Stop polling, let workers finish already claimed deliveries and stop them"""
+        if not self._pollers:
+            return
+        for poller in self._pollers:
+            poller.cancel()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues.values())),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            # Незавершенные записи вернутся в работу после истечения аренды
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._pollers, *self._tasks, return_exceptions=True)
+        self._pollers = []
+        self._tasks = []
@@ -0,0 +1,240 @@
+#Secondary bot file that is responsible for validating emails: syntax check and non-blocking DNS checks of the domain.
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple, Union
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from email_validator import validate_email, EmailNotValidError
+
+from cache import MISSING, TTLCache
+from metrics import PROVIDER_LATENCY, observe_latency
+
+# Жесткий лимит на один DNS-запрос, чтобы медленный сервер не держал обработчик
+DNS_QUERY_TIMEOUT = 3.0
+
+# Границы TTL для кэша вердиктов по доменам (секунды)
+DOMAIN_CACHE_MIN_TTL = 60
+DOMAIN_CACHE_MAX_TTL = 24 * 60 * 60
+DOMAIN_CACHE_NEGATIVE_TTL = 5 * 60
+
+_resolver: Optional[dns.asyncresolver.Resolver] = None
+
+def get_resolver() -> dns.asyncresolver.Resolver:
+    """Return the shared asynchronous resolver"""
+    global _resolver
+    if _resolver is None:
+        _resolver = dns.asyncresolver.Resolver()
+        _resolver.lifetime = DNS_QUERY_TIMEOUT
+    return _resolver
+
+class StaticResolver:
+    """In-memory stand-in for dns.asyncresolver.Resolver, for tests and offline runs
+
+    records maps (domain, rdtype) to a list of records or to an exception to raise;
+    unknown domains raise NXDOMAIN and empty lists raise NoAnswer. Answers carry
+    rrset.ttl like real dnspython answers.
+    """
+
+    def __init__(self, records: Dict[Tuple[str, str], Union[List, Exception]], delay: float = 0.0,
+                 ttl: int = 300):
+        self.records = records
+        self.delay = delay
+        self.ttl = ttl
+        self.queries: List[Tuple[str, str]] = []
+
+    async def resolve(self, qname, rdtype='A', lifetime: Optional[float] = None, **kwargs):
+        domain = str(qname).rstrip('.').lower()
+        self.queries.append((domain, rdtype))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        result = self.records.get((domain, rdtype))
+        if result is None:
+            if any(known == domain for known, _ in self.records):
+                raise dns.resolver.NoAnswer()
+            raise dns.resolver.NXDOMAIN()
+        if isinstance(result, Exception):
+            raise result
+        if not result:
+            raise dns.resolver.NoAnswer()
+        return _StaticAnswer(result, self.ttl)
+
+class _StaticAnswer(list):
+    def __init__(self, records: List, ttl: int):
+        super().__init__(records)
+        self.rrset = SimpleNamespace(ttl=ttl)
+
+class DomainCache:
+    """Per-domain deliverability verdicts with DNS-derived TTLs, optionally persisted to SQLite
+
+    Rows are written behind, on a thread of their own: a busy database file must not
+    stall the event loop that calls set().
+    """
+
+    def __init__(self, maxsize: int = 5000, negative_ttl: float = DOMAIN_CACHE_NEGATIVE_TTL,
+                 db_file: Optional[str] = None):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=DOMAIN_CACHE_MAX_TTL, negative_ttl=negative_ttl)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if db_file is not None:
+            self._open(db_file)
+
+    def _open(self, db_file: str):
+        """Create the verdict table and warm the cache with unexpired rows"""
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS email_domains (
+                domain TEXT PRIMARY KEY,
+                is_valid BOOLEAN NOT NULL,
+                error TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        now = time.time()
+        self._conn.execute('DELETE FROM email_domains WHERE expires_at <= ?', (now,))
+        self._conn.commit()
+
+        rows = self._conn.execute('SELECT domain, is_valid, error, expires_at FROM email_domains')
+        for domain, is_valid, error, expires_at in rows:
+            self._cache.set(domain, (bool(is_valid), error), ttl=expires_at - now)
+        # Один поток записи: порядок записей сохраняется, цикл событий не ждет блокировок файла
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='domain-cache')
+
+    def get(self, domain: str) -> Optional[Tuple[bool, str]]:
+        """Return cached (is_valid, error_message) verdict or None"""
+        verdict = self._cache.get(domain)
+        return None if verdict is MISSING else verdict
+
+    def set(self, domain: str, verdict: Tuple[bool, str], ttl: float):
+        """Store a verdict for ttl seconds (the row is persisted in the background)"""
+        self._cache.set(domain, verdict, ttl=ttl)
+        if self._writer is not None:
+            self._writer.submit(self._persist, domain, verdict, time.time() + ttl)
+
+    def _persist(self, domain: str, verdict: Tuple[bool, str], expires_at: float):
+        with self._conn_lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO email_domains (domain, is_valid, error, expires_at) VALUES (?, ?, ?, ?)',
+                    (domain, verdict[0], verdict[1], expires_at)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # Вердикт уже в памяти; без строки в таблице он просто не переживет перезапуск
+                logging.warning(f"Failed to persist email domain verdict for {domain}: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """Return cache counters with the hit ratio"""
+        stats = self._cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self._writer is not None:
+            # Дописываем отложенные вердикты перед закрытием соединения
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+async def _resolve(resolver, domain: str, rdtype: str, timeout: float):
+    """Run one DNS query with a strict timeout"""
+    return await asyncio.wait_for(resolver.resolve(domain, rdtype, lifetime=timeout), timeout)
+
+def _is_missing(result) -> bool:
+    return isinstance(result, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer))
+
+def _is_timeout(result) -> bool:
+    return isinstance(result, (asyncio.TimeoutError, dns.exception.Timeout))
+
+def _answer_ttl(answer) -> int:
+    rrset = getattr(answer, 'rrset', None)
+    return getattr(rrset, 'ttl', DOMAIN_CACHE_MIN_TTL)
+
+# Время DNS-проверок домена; попадания в кэш сюда не доходят
+@observe_latency(PROVIDER_LATENCY, 'dns', success=lambda verdict: verdict[0])
+async def check_domain(domain: str, resolver=None, timeout: float = DNS_QUERY_TIMEOUT,
+                       negative_ttl: float = DOMAIN_CACHE_NEGATIVE_TTL) -> Tuple[bool, str, Optional[float]]:
+    """
+    Check that domain accepts mail and resolves to an address
+    Returns: (is_valid, error_message, cache_ttl); cache_ttl is None for verdicts that must not be cached
+    """
+    if resolver is None:
+        resolver = get_resolver()
+
+    # MX, A и AAAA запрашиваем параллельно
+    mx, a, aaaa = await asyncio.gather(
+        _resolve(resolver, domain, 'MX', timeout),
+        _resolve(resolver, domain, 'A', timeout),
+        _resolve(resolver, domain, 'AAAA', timeout),
+        return_exceptions=True
+    )
+
+    # Ошибки сети и таймауты не кэшируем - это не свойство домена
+    if isinstance(mx, dns.resolver.NXDOMAIN):
+        return False, "Домен email не существует", negative_ttl
+    if isinstance(mx, dns.resolver.NoAnswer):
+        return False, "Домен email не настроен корректно", negative_ttl
+    if _is_timeout(mx):
+        return False, "Ошибка при проверке домена email: превышено время ожидания DNS", None
+    if isinstance(mx, BaseException):
+        return False, f"Ошибка при проверке домена email: {str(mx)}", None
+    if not list(mx):
+        return False, "Домен не принимает почту (нет MX-записей)", negative_ttl
+
+    # Достаточно A или AAAA записи
+    for address in (a, aaaa):
+        if not isinstance(address, BaseException):
+            # Положительный вердикт живет не дольше самой короткой из записей
+            ttl = min(_answer_ttl(mx), _answer_ttl(address))
+            return True, "", max(DOMAIN_CACHE_MIN_TTL, min(ttl, DOMAIN_CACHE_MAX_TTL))
+        if not _is_missing(address):
+            if _is_timeout(address):
+                return False, "Ошибка при проверке домена email: превышено время ожидания DNS", None
+            return False, f"Ошибка при проверке домена email: {str(address)}", None
+
+    return False, "Домен не существует (нет A или AAAA записей)", negative_ttl
+
+async def is_valid_email(email: str, resolver=None, timeout: float = DNS_QUERY_TIMEOUT,
+                         cache: Optional[DomainCache] = None) -> tuple[bool, str]:
+    """
+    Validate email and check if domain exists
+    Returns: (is_valid, error_message)
+    """
+    try:
+        # Только синтаксис: DNS проверяем сами, чтобы не делать те же запросы дважды
+        validation = validate_email(email, check_deliverability=False)
+    except EmailNotValidError as e:
+        return False, f"Неверный формат email: {str(e)}"
+    except Exception as e:
+        return False, f"Ошибка при проверке email: {str(e)}"
+
+    domain = validation.ascii_domain.lower()
+    if cache is not None:
+        verdict = cache.get(domain)
+        if verdict is not None:
+            return verdict
+
+    negative_ttl = cache.negative_ttl if cache is not None else DOMAIN_CACHE_NEGATIVE_TTL
+    is_valid, error, ttl = await check_domain(domain, resolver, timeout, negative_ttl)
+    if cache is not None and ttl is not None:
+        cache.set(domain, (is_valid, error), ttl)
+    return is_valid, error
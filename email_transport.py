@@ -0,0 +1,182 @@
+#Secondary bot file that is responsible for delivering emails: a pool of authenticated SMTP connections used asynchronously.
+
+import asyncio
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from typing import Optional, Tuple
+
+def build_text_message(sender: str, recipient: str, subject: str, body: str) -> MIMEText:
+    """Build a single-part plain text message"""
+    msg = MIMEText(body, 'plain', 'utf-8')
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    return msg
+
+class SMTPPool:
+    """Bounded pool of logged-in SMTP connections, reconnecting dead ones on demand"""
+
+    def __init__(self, host: str, port: int, username: str = "", password: str = "", size: int = 2,
+                 use_starttls: bool = True, timeout: float = 10.0, keepalive_interval: float = 60.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_starttls = use_starttls
+        self.timeout = timeout
+        self.keepalive_interval = keepalive_interval
+
+        # Свободные соединения вместе со временем последнего использования
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, float]]" = queue.LifoQueue()
+        # Ограничивает общее число соединений (свободных и занятых)
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open, secure and authenticate a new connection"""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            self._quit(server)
+            raise
+        return server
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _is_alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self) -> smtplib.SMTP:
+        """Take an idle connection (checking it if it sat long) or open a new one"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - last_used < self.keepalive_interval or self._is_alive(server):
+                    return server
+                self._quit(server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, server: Optional[smtplib.SMTP]):
+        if server is not None:
+            if self._closed:
+                self._quit(server)
+            else:
+                self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def send(self, msg: MIMEText):
+        """Send a message, reconnecting and retrying once if the connection was dropped"""
+        server = self._acquire()
+        try:
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._quit(server)
+                server = None
+                server = self._connect()
+                server.send_message(msg)
+        except Exception:
+            if server is not None:
+                self._quit(server)
+                server = None
+            raise
+        finally:
+            self._release(server)
+
+    def keepalive(self) -> int:
+        """NOOP idle connections, drop the dead ones and return how many are alive"""
+        alive = 0
+        for _ in range(self._idle.qsize()):
+            # Проверяемое соединение занимает слот, как и при отправке
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                self._slots.release()
+                break
+
+            if self._is_alive(server):
+                self._idle.put((server, last_used))
+                alive += 1
+            else:
+                self._quit(server)
+            self._slots.release()
+        return alive
+
+    def close(self):
+        """Close all idle connections; busy ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(server)
+
+class AsyncEmailSender:
+    """Sends messages through an SMTPPool on worker threads without blocking the event loop"""
+
+    def __init__(self, pool: SMTPPool):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='smtp')
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+    async def send(self, msg: MIMEText) -> bool:
+        """Send a message and report whether it was accepted by the server"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.pool.send, msg)
+            return True
+        except Exception as e:
+            logging.error(f"Error sending email to {msg['To']}: {e}")
+            return False
+
+    def start_background_tasks(self):
+        """Start periodic NOOP keepalive of idle connections on the running loop"""
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive_periodically())
+
+    async def _keepalive_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.pool.keepalive_interval)
+            await loop.run_in_executor(self._executor, self.pool.keepalive)
+
+    async def close(self):
+        """Stop keepalive and close the pool"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.pool.close)
+        self._executor.shutdown(wait=True)
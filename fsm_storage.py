@@ -0,0 +1,248 @@
+#Secondary bot file that is responsible for keeping FSM (registration progress) outside of the process memory.
+
+import asyncio
+import copy
+import json
+import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import partial, wraps
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import MISSING, TTLCache
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in an SQLite (WAL) table with a write-through in-memory cache
+
+    The cache assumes that a given chat is served by one process at a time
+    (a single bot process, or processes sharded by chat); cache_ttl bounds how
+    long an entry can be reused without re-reading the table.
+    """
+
+    def __init__(self, db_file: str, cache_size: int = 10000, cache_ttl: float = 600.0):
+        self.db_file = db_file
+        # Один поток на все операции с таблицей, как и в AsyncDatabase
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-storage')
+        self._conn: Optional[sqlite3.Connection] = self._executor.submit(self._connect).result()
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        ))
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        row = self._conn.execute('SELECT state, data FROM fsm_storage WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _store(self, key: str, state: Optional[str], data: str):
+        if state is None and data == '{}':
+            # Пустые записи не храним
+            self._conn.execute('DELETE FROM fsm_storage WHERE key = ?', (key,))
+        else:
+            self._conn.execute('''
+                INSERT INTO fsm_storage (key, state, data) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data
+            ''', (key, state, data))
+        self._conn.commit()
+
+    async def _get(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is MISSING:
+            entry = await self._run(self._load, key)
+            self._cache.set(key, entry)
+        return entry
+
+    async def _put(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        await self._run(self._store, key, state, json.dumps(data, ensure_ascii=False))
+        self._cache.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        _, data = await self._get(storage_key)
+        await self._put(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self._key(key)
+        state, _ = await self._get(storage_key)
+        await self._put(storage_key, state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(self._key(key))
+        # Глубокая копия: обработчики меняют вложенные списки, а кэш должен совпадать с таблицей
+        return copy.deepcopy(data)
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """Replace state and data with a single write"""
+        await self._put(self._key(key), state.state if isinstance(state, State) else state, copy.deepcopy(dict(data)))
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
+
+def create_storage(url: str) -> BaseStorage:
+    """Build FSM storage from a URL: redis://... for Redis, otherwise an SQLite file path"""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        # Redis-совместимое хранилище из aiogram; работает и с локальными заменами Redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(url)
+    return SQLiteStorage(url)
+
+# Счетчик операций с хранилищем для текущего апдейта (устанавливается StorageOpsMiddleware)
+update_storage_ops: ContextVar[Optional[List[int]]] = ContextVar('update_storage_ops', default=None)
+
+class CountingStorage(BaseStorage):
+    """Delegating storage that counts operations, in total and for the current update"""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+        self.operations: Counter = Counter()
+
+    def _count(self, operation: str):
+        self.operations[operation] += 1
+        update_ops = update_storage_ops.get()
+        if update_ops is not None:
+            update_ops[0] += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._count('set_state')
+        await self.storage.set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        self._count('get_state')
+        return await self.storage.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self._count('set_data')
+        await self.storage.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        self._count('get_data')
+        return await self.storage.get_data(key)
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        self._count('set_record')
+        await set_record(self.storage, key, state, data)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+async def set_record(storage: BaseStorage, key: StorageKey, state: StateType, data: Mapping[str, Any]):
+    """Write state and data together, in one operation when the storage supports it"""
+    if hasattr(storage, 'set_record'):
+        await storage.set_record(key, state, data)
+    else:
+        await storage.set_state(key, state)
+        await storage.set_data(key, data)
+
+class StagedFSMContext(FSMContext):
+    """FSMContext that reads state and data at most once and writes all changes in commit()
+
+    commit() writes the whole data snapshot, so updates of one chat must not run concurrently:
+    the dispatcher is built with SimpleEventIsolation, and code outside handlers takes its lock.
+    """
+
+    def __init__(self, context: FSMContext):
+        super().__init__(context.storage, context.key)
+        self._state: Any = MISSING
+        self._data: Optional[Dict[str, Any]] = None
+        self._state_changed = False
+        self._data_changed = False
+
+    async def _load_data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+        return self._data
+
+    async def get_state(self) -> Optional[str]:
+        if self._state is MISSING:
+            self._state = await self.storage.get_state(key=self.key)
+        return self._state
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        return dict(await self._load_data())
+
+    async def set_data(self, data: Mapping[str, Any]) -> None:
+        self._data = dict(data)
+        self._data_changed = True
+
+    async def get_value(self, key: str, default: Any = None) -> Any:
+        return (await self._load_data()).get(key, default)
+
+    async def update_data(self, data: Optional[Mapping[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current = await self._load_data()
+        current.update(kwargs)
+        self._data_changed = True
+        return dict(current)
+
+    async def clear(self) -> None:
+        self._state = None
+        self._data = {}
+        self._state_changed = True
+        self._data_changed = True
+
+    async def commit(self):
+        """Write staged changes with a single storage operation"""
+        if self._state_changed and self._data_changed:
+            await set_record(self.storage, self.key, self._state, self._data)
+        elif self._state_changed:
+            await self.storage.set_state(key=self.key, state=self._state)
+        elif self._data_changed:
+            await self.storage.set_data(key=self.key, data=self._data)
+        self._state_changed = False
+        self._data_changed = False
+
+def staged_state(handler):
+    """Run a handler with a StagedFSMContext and commit its changes when it returns"""
+    @wraps(handler)
+    async def wrapper(event, state: FSMContext, *args, **kwargs):
+        staged = StagedFSMContext(state)
+        result = await handler(event, staged, *args, **kwargs)
+        await staged.commit()
+        return result
+    return wrapper
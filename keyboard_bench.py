@@ -0,0 +1,53 @@
+#Helper script that measures registration keyboard construction and serialization, uncached vs memoized.
+
+import argparse
+import time
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+
+from keyboards import _build_registration_keyboard, get_registration_keyboard
+
+# Типичные состояния формы регистрации, по которым проходит пользователь
+SAMPLES = [
+    {},
+    {'name': 'Иван'},
+    {'name': 'Иван', 'contact': 'ivan@example.com'},
+    {'name': 'Иван', 'contact': 'ivan@example.com', 'password': 'Secret#123', 'password_confirm': None},
+    {'name': 'Иван', 'contact': 'ivan@example.com', 'password': 'Secret#123', 'password_confirm': 'Secret#123'},
+]
+
+def build_uncached(user_data: dict) -> InlineKeyboardMarkup:
+    """The previous get_registration_keyboard: new pydantic objects on every call"""
+    return _build_registration_keyboard.__wrapped__(
+        (user_data['name'],) if 'name' in user_data else None,
+        (user_data['contact'],) if 'contact' in user_data else None,
+        len(user_data.get('password') or ''),
+        len(user_data.get('password_confirm') or ''),
+        all(field in user_data for field in ('name', 'contact', 'password', 'password_confirm'))
+    )
+
+def measure(name: str, build, rounds: int, bot: Bot):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for user_data in SAMPLES:
+            build(user_data)
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for user_data in SAMPLES:
+            # Так же сериализует reply_markup сессия aiogram перед отправкой
+            bot.session.prepare_value(build(user_data), bot=bot, files={})
+    serialized = time.perf_counter() - started
+
+    calls = rounds * len(SAMPLES)
+    print(f"{name}: build {built / calls * 1e6:.1f}us, build + serialize {serialized / calls * 1e6:.1f}us per keyboard")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark registration keyboard construction")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+    bot = Bot(token="123456:benchmark")
+    measure("uncached", build_uncached, args.rounds, bot)
+    measure("memoized", get_registration_keyboard, args.rounds, bot)
@@ -0,0 +1,79 @@
+#Secondary bot file with the bot keyboards: static ones are built once, the registration keyboard is memoized.
+
+from functools import lru_cache
+from typing import Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+REGISTRATION_FIELDS = ('name', 'contact', 'password', 'password_confirm')
+
+# Разметка общая для всех сообщений, поэтому ее нельзя менять после создания
+
+BACK_BUTTON = InlineKeyboardButton(text="« Назад", callback_data="reg_back")
+
+BACK_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[BACK_BUTTON]])
+
+CONTACT_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Использовать текущий номер", callback_data="reg_use_current_phone")],
+    [BACK_BUTTON]
+])
+
+CONTACT_REQUEST_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="Отправить номер телефона", request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+@lru_cache(maxsize=4096)
+def _build_registration_keyboard(name: Optional[tuple], contact: Optional[tuple],
+                                 password_length: int, password_confirm_length: int,
+                                 complete: bool) -> InlineKeyboardMarkup:
+    # name и contact - (значение,) если поле есть в данных, иначе None
+    buttons = [
+        InlineKeyboardButton(
+            text=f"Имя: {name[0]}" if name is not None else "Имя",
+            callback_data="reg_name"
+        ),
+        InlineKeyboardButton(
+            text=f"Почта / Номер: {contact[0]}" if contact is not None else "Почта / Номер",
+            callback_data="reg_contact"
+        ),
+        InlineKeyboardButton(
+            text="Пароль: " + ("●" * password_length if password_length else "Не указан"),
+            callback_data="reg_password"
+        ),
+        InlineKeyboardButton(
+            text="Подтвердите пароль: " + ("●" * password_confirm_length if password_confirm_length else "Не указан"),
+            callback_data="reg_password_confirm"
+        )
+    ]
+
+    # Add "Готово" button only if all fields are filled
+    if complete:
+        buttons.append(InlineKeyboardButton(text="Готово", callback_data="reg_complete"))
+
+    return InlineKeyboardMarkup(inline_keyboard=[[button] for button in buttons])
+
+def get_registration_keyboard(user_data: dict = None) -> InlineKeyboardMarkup:
+    """Create registration keyboard with user data if available"""
+    if user_data is None:
+        user_data = {}
+
+    # Пароль в данных хранится хэшем, длина маски - отдельно; подтверждение - флаг совпадения
+    password = user_data.get('password') or ''
+    password_length = user_data.get('password_length', len(password)) if password else 0
+    password_confirm_length = password_length if user_data.get('password_confirm') else 0
+
+    # Ключ кэша: видимые на кнопках значения, а от паролей - только длина маски
+    return _build_registration_keyboard(
+        (user_data['name'],) if 'name' in user_data else None,
+        (user_data['contact'],) if 'contact' in user_data else None,
+        password_length,
+        password_confirm_length,
+        all(field in user_data for field in REGISTRATION_FIELDS)
+    )
+
+def keyboard_cache_stats() -> dict:
+    """Return registration keyboard cache counters"""
+    info = _build_registration_keyboard.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
@@ -1,21 +1,37 @@
 #The main bot file where handlers, handlers and so on are located
 
 import asyncio
+import hmac
 import logging
-import re
-import dns.resolver
-import phonenumbers
-from email_validator import validate_email, EmailNotValidError
+import os
+import secrets
+import signal
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 import sys
-from database import Database
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from database import CODE_EXHAUSTED, CODE_EXPIRED, CODE_INVALID, AsyncDatabase
+from passwords import PasswordHasher, is_password_hash
 from verification import Verification
+from email_check import DomainCache
+from contact_check import ContactValidator
+from password_filter import open_filter
+from phone import is_valid_phone
+from delivery import DeliveryService
+from fsm_storage import CountingStorage, StagedFSMContext, create_storage, staged_state
+from middlewares import FloodControlMiddleware, StorageOpsMiddleware
+from message_cleanup import MessageCleaner
+from registration_view import RegistrationView
+from keyboards import BACK_KEYBOARD, CONTACT_KEYBOARD, CONTACT_REQUEST_KEYBOARD, get_registration_keyboard, keyboard_cache_stats
+from metrics import REGISTRY, MetricsMiddleware, MetricsServer
+from sharding import ShardSupervisor
 import sqlite3
+import time
 
 # Enable logging
 logging.basicConfig(level=logging.INFO)
@@ -23,13 +39,89 @@ logging.basicConfig(level=logging.INFO)
 # Bot token from @BotFather
 BOT_TOKEN = ""
 
+# Webhook mode: set WEBHOOK_URL (public https base) to receive updates via webhook instead of polling
+WEBHOOK_URL = ""
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token; пустой - случайный на каждый запуск
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+
+# Sharded mode: route updates by chat to this many worker processes (0 or 1 = handle in this process)
+SHARD_WORKERS = 0
+
+# Prometheus metrics endpoint (0 = disabled); shard workers listen on METRICS_PORT + 1 + shard index
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Leaked password Bloom filter built by build_password_filter.py (skipped if the file is missing)
+LEAKED_PASSWORDS_FILE = "breached_passwords.bloom"
+
+# Verification codes: lifetime in seconds and allowed wrong entries before the account is blocked
+VERIFICATION_CODE_TTL = 600
+VERIFICATION_MAX_ATTEMPTS = 5
+
+# FSM storage: SQLite file path, or redis://host:port/db to share state between processes
+FSM_STORAGE_URL = "shop_bot.db"
+
+# Обработчики работают везде, кроме маршрутизирующего процесса шардированного режима
+# (воркеры импортируют этот модуль под другим именем). Ему не нужны ни база, ни хранилище FSM, ни отправка кодов
+HANDLES_UPDATES = SHARD_WORKERS <= 1 or __name__ != "__main__"
+
+# Пароли хэшируются в пуле процессов; он же используется для проверки пароля.
+# Пул форкается здесь, пока в процессе нет потоков (их запускают хранилище FSM и база ниже).
+# В шардированном режиме у каждого воркера своя доля ядер, а маршрутизирующий процесс пул не держит
+password_hasher = PasswordHasher(
+    workers=max(1, (os.cpu_count() or 1) // SHARD_WORKERS) if SHARD_WORKERS > 1 else None
+)
+if HANDLES_UPDATES:
+    password_hasher.prestart()
+
 # Initialize bot and dispatcher
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Обработчики пишут данные FSM целым снимком в конце (StagedFSMContext.commit), поэтому апдейты
+# одного чата выполняются по очереди, иначе второй затер бы ключи первого.
+# Маршрутизатору dp нужен только для списка типов апдейтов - хранилище остается по умолчанию, в памяти
+dp = Dispatcher(
+    storage=CountingStorage(create_storage(FSM_STORAGE_URL)) if HANDLES_UPDATES else None,
+    events_isolation=SimpleEventIsolation()
+)
+
+# aiogram закрывает хранилище FSM первым обработчиком shutdown, а очередь отправки кодов
+# при остановке еще пишет в него через on_delivery_failed. Снимаем его и закрываем хранилище в on_shutdown
+dp.shutdown.handlers[:] = [handler for handler in dp.shutdown.handlers if handler.callback != dp.fsm.close]
+
+# Наши outer-middleware должны стоять перед FSM-middleware aiogram: оно читает состояние
+# (raw_state) на каждом апдейте. Снимаем его и регистрируем снова после своих
+dp.update.outer_middleware.unregister(dp.fsm)
 
-# Initialize database and verification
-db = Database('shop_bot.db')
-verification = Verification()
+# Отсекаем флуд до обработчиков: лимиты на пользователя и общий предел дорогих апдейтов
+flood_control = FloodControlMiddleware()
+dp.update.outer_middleware(flood_control)
+
+# Считаем операции с хранилищем FSM на каждый апдейт, включая чтение состояния FSM-middleware
+storage_ops = StorageOpsMiddleware()
+dp.update.outer_middleware(storage_ops)
+
+dp.update.outer_middleware(dp.fsm)
+
+# Время и ошибки обработчиков; inner-middleware видит, какой обработчик выбран
+metrics_middleware = MetricsMiddleware()
+dp.message.middleware(metrics_middleware)
+dp.callback_query.middleware(metrics_middleware)
+
+# Initialize database and verification (only where handlers run: each holds threads or SQLite connections)
+if HANDLES_UPDATES:
+    db = AsyncDatabase('shop_bot.db', password_hasher=password_hasher)
+    verification = Verification()
+    email_domain_cache = DomainCache(db_file='shop_bot.db')
+    leaked_passwords = open_filter(LEAKED_PASSWORDS_FILE)
+    if leaked_passwords is None:
+        logging.warning(f"Leaked password filter {LEAKED_PASSWORDS_FILE} not available, the check is disabled")
+else:
+    db = verification = email_domain_cache = leaked_passwords = None
+contact_validator = ContactValidator(domain_cache=email_domain_cache)
+message_cleaner = MessageCleaner()
+registration_view = RegistrationView()
 
 # States
 class RegistrationStates(StatesGroup):
@@ -39,121 +131,11 @@ class RegistrationStates(StatesGroup):
     WAITING_PASSWORD_CONFIRM = State()
     WAITING_VERIFICATION = State()
 
-def get_registration_keyboard(user_data: dict = None) -> InlineKeyboardMarkup:
-    """Create registration keyboard with user data if available"""
-    if user_data is None:
-        user_data = {}
-    
-    buttons = [
-        InlineKeyboardButton(
-            text=f"Имя: {user_data.get('name', 'Не указано')}" if 'name' in user_data else "Имя",
-            callback_data="reg_name"
-        ),
-        InlineKeyboardButton(
-            text=f"Почта / Номер: {user_data.get('contact', 'Не указано')}" if 'contact' in user_data else "Почта / Номер",
-            callback_data="reg_contact"
-        ),
-        InlineKeyboardButton(
-            text="Пароль: " + ("●" * len(user_data.get('password', '')) if user_data.get('password') else "Не указан"),
-            callback_data="reg_password"
-        ),
-        InlineKeyboardButton(
-            text="Подтвердите пароль: " + ("●" * len(user_data.get('password_confirm', '')) if user_data.get('password_confirm') else "Не указан"),
-            callback_data="reg_password_confirm"
-        )
-    ]
-    
-    # Add "Готово" button only if all fields are filled
-    if all(field in user_data for field in ['name', 'contact', 'password', 'password_confirm']):
-        buttons.append(InlineKeyboardButton(text="Готово", callback_data="reg_complete"))
-    
-    keyboard = []
-    for button in buttons:
-        keyboard.append([button])
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-def is_valid_phone(phone: str) -> tuple[bool, str]:
-    """
-    Validate phone number and check if it exists
-    Returns: (is_valid, error_message)
-    """
-    # Паттерн для проверки украинского номера телефона
-    pattern = r'^(?:\+?38)?0\d{9}$'
-    if not re.match(pattern, phone):
-        return False, "Неверный формат номера телефона"
-    
-    try:
-        # Нормализуем номер телефона
-        if not phone.startswith('+'):
-            if phone.startswith('38'):
-                phone = '+' + phone
-            else:
-                phone = '+38' + phone
-        
-        # Парсим номер
-        phone_number = phonenumbers.parse(phone)
-        
-        # Проверяем регион (должен быть Украина)
-        if phonenumbers.region_code_for_number(phone_number) != 'UA':
-            return False, "Номер телефона должен быть украинским"
-        
-        # Проверяем, существует ли такой номер
-        if not phonenumbers.is_valid_number(phone_number):
-            return False, "Такой номер телефона не существует"
-        
-        # Проверяем, является ли номер мобильным
-        if phonenumbers.number_type(phone_number) != phonenumbers.PhoneNumberType.MOBILE:
-            return False, "Номер телефона должен быть мобильным"
-        
-        # Проверяем возможность существования номера
-        if not phonenumbers.is_possible_number(phone_number):
-            return False, "Номер телефона не может существовать в указанном регионе"
-        
-        return True, ""
-    except Exception as e:
-        return False, "Ошибка при проверке номера телефона"
-
-def is_valid_email(email: str) -> tuple[bool, str]:
-    """
-    Validate email and check if domain exists
-    Returns: (is_valid, error_message)
-    """
-    try:
-        # Базовая валидация email с проверкой доставки
-        validation = validate_email(email, check_deliverability=True)
-        email = validation.normalized
-        
-        # Получаем домен
-        domain = email.split('@')[1]
-        
-        try:
-            # Проверяем существование MX-записей для домена
-            mx_records = dns.resolver.resolve(domain, 'MX')
-            if not list(mx_records):
-                return False, "Домен не принимает почту (нет MX-записей)"
-            
-            # Проверяем существование A-записи
-            try:
-                dns.resolver.resolve(domain, 'A')
-            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-                try:
-                    dns.resolver.resolve(domain, 'AAAA')
-                except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-                    return False, "Домен не существует (нет A или AAAA записей)"
-            
-            return True, ""
-        except dns.resolver.NXDOMAIN:
-            return False, "Домен email не существует"
-        except dns.resolver.NoAnswer:
-            return False, "Домен email не настроен корректно"
-        except Exception as e:
-            return False, f"Ошибка при проверке домена email: {str(e)}"
-            
-    except EmailNotValidError as e:
-        return False, f"Неверный формат email: {str(e)}"
-    except Exception as e:
-        return False, f"Ошибка при проверке email: {str(e)}"
+async def matches_staged_password(password: str, staged: str) -> bool:
+    """Check input against the password kept in FSM data (a hash; plain text in sessions started earlier)"""
+    if is_password_hash(staged):
+        return await password_hasher.verify(password, staged)
+    return hmac.compare_digest(password.encode('utf-8'), staged.encode('utf-8'))
 
 def is_valid_password(password: str) -> tuple[bool, str]:
     """
@@ -163,10 +145,18 @@ def is_valid_password(password: str) -> tuple[bool, str]:
     if len(password) < 8:
         return False, "Пароль должен содержать минимум 8 символов"
     
-    has_upper = any(c.isupper() for c in password)
-    has_lower = any(c.islower() for c in password)
-    has_digit = any(c.isdigit() for c in password)
-    has_special = any(not c.isalnum() for c in password)
+    # Все классы символов за один проход по строке. Классы пересекаются (например, 'Ⓐ' -
+    # и заглавная буква, и спецсимвол), поэтому цифры и спецсимволы проверяются отдельно
+    has_upper = has_lower = has_digit = has_special = False
+    for c in password:
+        if c.isupper():
+            has_upper = True
+        elif c.islower():
+            has_lower = True
+        if c.isdigit():
+            has_digit = True
+        if not c.isalnum():
+            has_special = True
     
     if not has_upper:
         return False, "Пароль должен содержать хотя бы одну заглавную букву"
@@ -177,6 +167,10 @@ def is_valid_password(password: str) -> tuple[bool, str]:
     if not has_special:
         return False, "Пароль должен содержать хотя бы один специальный символ"
     
+    # Известные утекшие пароли отклоняем без обращения к сети
+    if leaked_passwords is not None and password in leaked_passwords:
+        return False, "Этот пароль встречается в утечках данных, придумайте другой"
+    
     return True, ""
 
 @dp.message(Command("start"))
@@ -184,13 +178,11 @@ async def cmd_start(message: types.Message, state: FSMContext):
     """Handle the /start command"""
     user_id = message.from_user.id
     
-    # Проверяем, существует ли пользователь
-    if not db.user_exists(user_id):
-        # Если пользователь не существует, создаем его
-        db.create_user(user_id)
+    # Одним запросом создаем пользователя (если его нет) и получаем его статус
+    status = await db.get_user_status(user_id)
     
     # Проверяем статус блокировки
-    if db.is_blocked(user_id):
+    if status.is_blocked:
         # Если пользователь заблокирован
         await message.answer(
             "❌ Ваш аккаунт заблокирован!\n"
@@ -199,18 +191,70 @@ async def cmd_start(message: types.Message, state: FSMContext):
         return
     
     # Проверяем авторизацию пользователя
-    if db.check_auth(user_id):
+    if status.is_authorized:
         # Обновляем время последнего входа
-        db.update_last_login(user_id)
+        await db.update_last_login(user_id)
         await message.answer("Привет еще раз!")
     else:
         # Если пользователь не авторизован и не заблокирован, начинаем регистрацию
-        await message.answer(
+        await registration_view.send(
+            message.bot, message.chat.id, state,
             "Здравствуйте! Для продолжения пользования ботом, пожалуйста, зарегистрируйтесь!",
-            reply_markup=get_registration_keyboard()
+            get_registration_keyboard()
+        )
+
+async def on_delivery_failed(telegram_id: int):
+    """Tell the user the code could not be delivered and return them to the registration menu"""
+    state = StagedFSMContext(dp.fsm.get_context(bot=bot, chat_id=telegram_id, user_id=telegram_id))
+    # Вызывается не из обработчика: берем ту же блокировку чата, что и диспетчер
+    async with dp.fsm.events_isolation.lock(key=state.key):
+        if await state.get_state() != RegistrationStates.WAITING_VERIFICATION.state:
+            return
+        
+        user_data = await state.get_data()
+        await state.set_state(None)
+        # Сбрасываем код, чтобы следующее нажатие "Готово" создало новое поколение
+        await db.delete_verification_code(telegram_id)
+        
+        # Сообщение с запросом кода превращается обратно в меню регистрации
+        await registration_view.show(
+            bot, telegram_id, state,
+            "Ошибка отправки кода подтверждения. Попробуйте позже.",
+            get_registration_keyboard(user_data)
         )
+        await state.commit()
+
+# Отправка кодов идет в фоне через очередь в базе данных
+delivery = DeliveryService(db, verification, on_failed=on_delivery_failed) if HANDLES_UPDATES else None
+
+# Счетчики сервисов отдаются на /metrics вместе с гистограммами; у маршрутизатора они всегда нулевые,
+# он отдает свои (см. run_sharded)
+if HANDLES_UPDATES:
+    REGISTRY.add_collector('flood_control', flood_control.stats)
+    REGISTRY.add_collector('storage_ops', storage_ops.stats)
+    REGISTRY.add_collector('delivery', delivery.stats)
+    REGISTRY.add_collector('email_domain_cache', email_domain_cache.stats)
+    REGISTRY.add_collector('contact', contact_validator.stats)
+    REGISTRY.add_collector('registration_view', registration_view.stats)
+    REGISTRY.add_collector('message_cleanup', message_cleaner.stats)
+    REGISTRY.add_collector('keyboard_cache', keyboard_cache_stats)
+    REGISTRY.add_collector('status_cache', db.cache_stats)
+    REGISTRY.add_collector('codes', lambda: {
+        'expired_deleted': db.expired_codes_deleted,
+        'finished_deliveries_deleted': db.finished_deliveries_deleted,
+    })
+metrics_server = MetricsServer(REGISTRY, METRICS_HOST, METRICS_PORT)
+
+async def show_in_callback_message(callback_query: types.CallbackQuery, state: FSMContext, text: str,
+                                   reply_markup: InlineKeyboardMarkup = None):
+    """Show registration view content in the message whose button was pressed"""
+    await registration_view.show(
+        callback_query.bot, callback_query.message.chat.id, state, text, reply_markup,
+        message_id=callback_query.message.message_id
+    )
 
 @dp.callback_query(lambda c: c.data.startswith('reg_'))
+@staged_state
 async def registration_callback(callback_query: types.CallbackQuery, state: FSMContext):
     """Handle registration callbacks"""
     action = callback_query.data[4:]  # Remove 'reg_' prefix
@@ -222,11 +266,7 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
             error_message_ids = user_data.get('error_message_ids', [])
             
             # Удаляем все сообщения об ошибках
-            for error_id in error_message_ids:
-                try:
-                    await callback_query.bot.delete_message(callback_query.message.chat.id, error_id)
-                except:
-                    pass
+            await message_cleaner.delete(callback_query.bot, callback_query.message.chat.id, error_message_ids)
             
             # Очищаем список ID сообщений об ошибках
             await state.update_data(error_message_ids=[])
@@ -243,22 +283,12 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
                 "Здравствуйте! Для продолжения пользования ботом, пожалуйста, зарегистрируйтесь!"
             )
             
-            await callback_query.message.edit_text(
-                message_text,
-                reply_markup=get_registration_keyboard(user_data)
-            )
+            await show_in_callback_message(callback_query, state, message_text, get_registration_keyboard(user_data))
         elif action == "use_current_phone":
-            # Создаем клавиатуру с кнопкой для отправки контакта
-            contact_keyboard = types.ReplyKeyboardMarkup(
-                keyboard=[[types.KeyboardButton(text="Отправить номер телефона", request_contact=True)]],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-            
             # Отправляем сообщение с кнопкой для отправки контакта
             contact_message = await callback_query.message.answer(
                 "Нажмите на кнопку ниже, чтобы отправить свой номер телефона:",
-                reply_markup=contact_keyboard
+                reply_markup=CONTACT_REQUEST_KEYBOARD
             )
             
             # Сохраняем ID сообщения с кнопкой
@@ -275,14 +305,7 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
                 if 'name' in user_data else 
                 "Пожалуйста, напишите, как мы можем к вам обращаться?"
             )
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="« Назад", callback_data="reg_back")
-            ]])
-            new_message = await callback_query.message.edit_text(
-                message_text,
-                reply_markup=keyboard
-            )
-            await state.update_data(bot_message_id=new_message.message_id)
+            await show_in_callback_message(callback_query, state, message_text, BACK_KEYBOARD)
         elif action == "contact":
             # Проверяем, заполнено ли имя
             if 'name' not in user_data:
@@ -295,20 +318,7 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
                 "Пожалуйста, укажите ваш контактный номер или email:"
             )
             
-            # Создаем инлайн клавиатуру с кнопками
-            inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Использовать текущий номер", callback_data="reg_use_current_phone")],
-                [InlineKeyboardButton(text="« Назад", callback_data="reg_back")]
-            ])
-            
-            # Отправляем сообщение
-            new_message = await callback_query.message.edit_text(
-                message_text,
-                reply_markup=inline_keyboard
-            )
-            
-            # Сохраняем ID сообщения
-            await state.update_data(bot_message_id=new_message.message_id)
+            await show_in_callback_message(callback_query, state, message_text, CONTACT_KEYBOARD)
         elif action == "password":
             # Проверяем, заполнены ли предыдущие поля
             if 'name' not in user_data:
@@ -323,14 +333,7 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
                 if 'password' in user_data else 
                 "Пожалуйста, введите пароль:"
             )
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="« Назад", callback_data="reg_back")
-            ]])
-            new_message = await callback_query.message.edit_text(
-                message_text,
-                reply_markup=keyboard
-            )
-            await state.update_data(bot_message_id=new_message.message_id)
+            await show_in_callback_message(callback_query, state, message_text, BACK_KEYBOARD)
         elif action == "password_confirm":
             # Проверяем, заполнены ли предыдущие поля
             if 'name' not in user_data:
@@ -348,49 +351,32 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
                 if 'password_confirm' in user_data else 
                 "Пожалуйста, подтвердите пароль:"
             )
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="« Назад", callback_data="reg_back")
-            ]])
-            new_message = await callback_query.message.edit_text(
-                message_text,
-                reply_markup=keyboard
-            )
-            await state.update_data(bot_message_id=new_message.message_id)
+            await show_in_callback_message(callback_query, state, message_text, BACK_KEYBOARD)
         elif action == "complete":
             user_data = await state.get_data()
-            if user_data['password'] != user_data['password_confirm']:
+            # password_confirm выставляется, только если подтверждение совпало с паролем
+            if not user_data.get('password_confirm'):
                 await callback_query.answer("Пароли не совпадают!", show_alert=True)
                 return
             
-            # Generate verification code
-            code = verification.generate_code()
-            await state.update_data(verification_code=code)
-            
             contact = user_data['contact']
-            success = False
             
-            # Determine contact type and send code
+            # Generate verification code; в базе хранится только его хэш. Повторное нажатие, пока код
+            # для того же контакта действует, база отклоняет сама: код не меняется и не шлется еще раз
+            code = verification.generate_code()
+            # Код и его отправка записываются одной транзакцией; результат придет от фоновых обработчиков
+            await delivery.send_code(callback_query.from_user.id, contact, code, time.time() + VERIFICATION_CODE_TTL)
+            
             if '@' in contact:
-                # Send email verification
-                success = verification.send_email_code(contact, code)
                 message = "Мы отправили код подтверждения на ваш email."
             else:
-                # Send SMS verification
-                success = verification.send_sms_code(contact, code)
                 message = "Мы отправили код подтверждения в SMS."
             
-            if success:
-                await state.set_state(RegistrationStates.WAITING_VERIFICATION)
-                new_message = await callback_query.message.edit_text(
-                    f"{message}\n\nПожалуйста, введите полученный 6-значный код:"
-                )
-                # Сохраняем ID сообщения с запросом кода
-                await state.update_data(bot_message_id=new_message.message_id)
-            else:
-                await callback_query.answer(
-                    "Ошибка отправки кода подтверждения. Попробуйте позже.",
-                    show_alert=True
-                )
+            await state.set_state(RegistrationStates.WAITING_VERIFICATION)
+            # Запрос кода показываем в том же сообщении
+            await show_in_callback_message(
+                callback_query, state, f"{message}\n\nПожалуйста, введите полученный 6-значный код:"
+            )
         
         # Отвечаем на callback query в конце обработки
         try:
@@ -406,11 +392,11 @@ async def registration_callback(callback_query: types.CallbackQuery, state: FSMC
             pass
 
 @dp.message(RegistrationStates.WAITING_NAME)
+@staged_state
 async def process_name(message: types.Message, state: FSMContext):
     """Process user's name input"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
     current_name = state_data.get('name')
     
@@ -431,18 +417,7 @@ async def process_name(message: types.Message, state: FSMContext):
         return
     
     # Если значение новое, удаляем все предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с запросом
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
+    await message_cleaner.delete(message.bot, message.chat.id, error_message_ids)
     
     # Очищаем список ID сообщений об ошибках
     await state.update_data(error_message_ids=[])
@@ -450,19 +425,19 @@ async def process_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text)
     user_data = await state.get_data()
     
-    # Отправляем новое сообщение и сохраняем его ID
-    new_message = await message.answer(
+    # Возвращаем меню регистрации в то же сообщение бота
+    await registration_view.show(
+        message.bot, message.chat.id, state,
         "Пожалуйста, заполните оставшиеся поля:",
-        reply_markup=get_registration_keyboard(user_data)
+        get_registration_keyboard(user_data)
     )
-    await state.update_data(bot_message_id=new_message.message_id)
 
 @dp.message(RegistrationStates.WAITING_CONTACT)
+@staged_state
 async def process_contact(message: types.Message, state: FSMContext):
     """Process user's contact input"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
     current_contact = state_data.get('contact')
     
@@ -493,33 +468,19 @@ async def process_contact(message: types.Message, state: FSMContext):
         await state.update_data(error_message_ids=error_message_ids)
         return
     
-    # Проверяем валидность введенных данных
-    is_valid = False
-    error_msg = ""
-    
-    # Пробуем как телефон
-    is_valid_phone_result, phone_error = is_valid_phone(contact)
-    if is_valid_phone_result:
-        is_valid = True
-    else:
-        # Если не телефон, пробуем как email
-        is_valid_email_result, email_error = is_valid_email(contact)
-        if is_valid_email_result:
-            is_valid = True
-        else:
-            error_msg = (
-                "❌ Введенные данные некорректны!\n\n"
-                f"Ошибка проверки телефона: {phone_error}\n"
-                f"Ошибка проверки email: {email_error}\n\n"
-                "Пожалуйста, введите:\n"
-                "- Корректный email (например: example@email.com)\n"
-                "- Или номер телефона в формате: +380xxxxxxxxx, 380xxxxxxxxx, 0xxxxxxxxx"
-            )
+    # Проверяем валидность введенных данных: по виду ввода выбирается
+    # только одна проверка (телефон или email), явный мусор отклоняется сразу
+    result = await contact_validator.check(contact)
     
-    if not is_valid:
+    if not result.is_valid:
         # Отправляем сообщение об ошибке
         error_message = await message.answer(
-            error_msg
+            "❌ Введенные данные некорректны!\n\n"
+            f"Ошибка проверки телефона: {result.phone_error}\n"
+            f"Ошибка проверки email: {result.email_error}\n\n"
+            "Пожалуйста, введите:\n"
+            "- Корректный email (например: example@email.com)\n"
+            "- Или номер телефона в формате: +380xxxxxxxxx, 380xxxxxxxxx, 0xxxxxxxxx"
         )
         # Сохраняем ID сообщения об ошибке
         error_message_ids.append(error_message.message_id)
@@ -527,26 +488,9 @@ async def process_contact(message: types.Message, state: FSMContext):
         return
     
     # Если данные валидны, удаляем все предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с запросом
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
-    
-    # Удаляем сообщение с кнопкой "Отправить номер"
+    # и сообщение с кнопкой "Отправить номер"
     last_messages = state_data.get('last_messages', [])
-    for msg_id in last_messages:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except:
-            pass
+    await message_cleaner.delete(message.bot, message.chat.id, error_message_ids, last_messages)
     
     # Очищаем список ID сообщений об ошибках
     await state.update_data(error_message_ids=[])
@@ -554,19 +498,19 @@ async def process_contact(message: types.Message, state: FSMContext):
     await state.update_data(contact=contact)
     user_data = await state.get_data()
     
-    # Отправляем новое сообщение и сохраняем его ID
-    new_message = await message.answer(
+    # Возвращаем меню регистрации в то же сообщение бота
+    await registration_view.show(
+        message.bot, message.chat.id, state,
         "Пожалуйста, заполните оставшиеся поля:",
-        reply_markup=get_registration_keyboard(user_data)
+        get_registration_keyboard(user_data)
     )
-    await state.update_data(bot_message_id=new_message.message_id)
 
 @dp.message(RegistrationStates.WAITING_PASSWORD)
+@staged_state
 async def process_password(message: types.Message, state: FSMContext):
     """Process user's password input"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
     current_password = state_data.get('password')
     
@@ -574,7 +518,7 @@ async def process_password(message: types.Message, state: FSMContext):
     await message.delete()
     
     # Проверяем, не совпадает ли с текущим значением
-    if current_password and message.text == current_password:
+    if current_password and await matches_staged_password(message.text, current_password):
         # Отправляем сообщение об ошибке
         error_message = await message.answer(
             "❌ Вы ввели тот же пароль!\n\n"
@@ -596,7 +540,8 @@ async def process_password(message: types.Message, state: FSMContext):
             "- Хотя бы одна заглавная буква\n"
             "- Хотя бы одна строчная буква\n"
             "- Хотя бы одна цифра\n"
-            "- Хотя бы один специальный символ"
+            "- Хотя бы один специальный символ\n"
+            "- Не встречаться в известных утечках паролей"
         )
         # Сохраняем ID сообщения об ошибке
         error_message_ids.append(error_message.message_id)
@@ -604,47 +549,42 @@ async def process_password(message: types.Message, state: FSMContext):
         return
     
     # Если пароль валидный, удаляем все предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с запросом
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
+    await message_cleaner.delete(message.bot, message.chat.id, error_message_ids)
     
     # Очищаем список ID сообщений об ошибках
     await state.update_data(error_message_ids=[])
     
+    # В данных FSM (они пишутся на диск) храним только хэш пароля и длину для маски на кнопке
+    password_hash = await password_hasher.hash(message.text)
+    
     # Сохраняем новый пароль и сбрасываем подтверждение пароля
-    await state.update_data(password=message.text, password_confirm=None)
+    await state.update_data(password=password_hash, password_length=len(message.text), password_confirm=None)
     user_data = await state.get_data()
     
-    # Отправляем новое сообщение и сохраняем его ID
-    new_message = await message.answer(
+    # Возвращаем меню регистрации в то же сообщение бота
+    await registration_view.show(
+        message.bot, message.chat.id, state,
         "Пожалуйста, заполните оставшиеся поля:",
-        reply_markup=get_registration_keyboard(user_data)
+        get_registration_keyboard(user_data)
     )
-    await state.update_data(bot_message_id=new_message.message_id)
 
 @dp.message(RegistrationStates.WAITING_PASSWORD_CONFIRM)
+@staged_state
 async def process_password_confirm(message: types.Message, state: FSMContext):
     """Process user's password confirmation input"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
     current_password_confirm = state_data.get('password_confirm')
     
     # Удаляем сообщение пользователя
     await message.delete()
     
+    # Подтверждение сверяем с хэшем пароля; само подтверждение не сохраняем
+    password_matches = await matches_staged_password(message.text, state_data.get('password', ''))
+    
     # Проверяем, не совпадает ли с текущим значением подтверждения
-    if current_password_confirm and message.text == current_password_confirm:
+    if current_password_confirm and password_matches:
         # Отправляем сообщение об ошибке
         error_message = await message.answer(
             "❌ Вы ввели то же подтверждение пароля!\n\n"
@@ -657,8 +597,7 @@ async def process_password_confirm(message: types.Message, state: FSMContext):
         return
     
     # Проверяем совпадение паролей
-    password = state_data.get('password', '')
-    if message.text != password:
+    if not password_matches:
         # Отправляем сообщение об ошибке
         error_message = await message.answer(
             "❌ Пароли не совпадают!\n\n"
@@ -671,63 +610,45 @@ async def process_password_confirm(message: types.Message, state: FSMContext):
         return
     
     # Если пароли совпадают, удаляем все предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с запросом
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
+    await message_cleaner.delete(message.bot, message.chat.id, error_message_ids)
     
     # Очищаем список ID сообщений об ошибках
     await state.update_data(error_message_ids=[])
     
-    await state.update_data(password_confirm=message.text)
+    await state.update_data(password_confirm=True)
     user_data = await state.get_data()
     
-    # Отправляем новое сообщение и сохраняем его ID
-    new_message = await message.answer(
+    # Возвращаем меню регистрации в то же сообщение бота
+    await registration_view.show(
+        message.bot, message.chat.id, state,
         "Пожалуйста, заполните оставшиеся поля:",
-        reply_markup=get_registration_keyboard(user_data)
+        get_registration_keyboard(user_data)
     )
-    await state.update_data(bot_message_id=new_message.message_id)
 
 @dp.message(RegistrationStates.WAITING_VERIFICATION)
+@staged_state
 async def process_verification(message: types.Message, state: FSMContext):
     """Process verification code input"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    verification_code = state_data.get('verification_code')
     bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
-    attempts = state_data.get('verification_attempts', 0)
     
     # Удаляем сообщение пользователя
     await message.delete()
     
+    # Проверка кода и учет попытки - один запрос по первичному ключу
+    result = await db.check_verification_code(
+        message.from_user.id, (message.text or '').strip(), time.time(), VERIFICATION_MAX_ATTEMPTS
+    )
+    
     # Проверяем количество попыток
-    if attempts >= 5:
+    if result.status == CODE_EXHAUSTED:
         # Блокируем пользователя
-        db.block_user(message.from_user.id)
+        await db.block_user(message.from_user.id)
         
-        # Удаляем все предыдущие сообщения об ошибках
-        for error_id in error_message_ids:
-            try:
-                await message.bot.delete_message(message.chat.id, error_id)
-            except:
-                pass
-        
-        # Удаляем предыдущее сообщение бота с запросом кода
-        if bot_message_id:
-            try:
-                await message.bot.delete_message(message.chat.id, bot_message_id)
-            except:
-                pass
+        # Удаляем все предыдущие сообщения об ошибках и сообщение бота с запросом кода
+        await message_cleaner.delete(message.bot, message.chat.id, error_message_ids, [bot_message_id])
         
         # Отправляем сообщение о блокировке
         await message.answer(
@@ -739,17 +660,25 @@ async def process_verification(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
+    # Код истек (или удален уборщиком) - возвращаем в меню за новым кодом
+    if result.status == CODE_EXPIRED:
+        await message_cleaner.delete(message.bot, message.chat.id, error_message_ids)
+        await state.update_data(error_message_ids=[])
+        await state.set_state(None)
+        await registration_view.show(
+            message.bot, message.chat.id, state,
+            "❌ Срок действия кода подтверждения истек.\n\n"
+            "Нажмите «Готово», чтобы получить новый код.",
+            get_registration_keyboard(state_data)
+        )
+        return
+    
     # Проверяем код
-    if message.text.strip() != verification_code:
-        # Увеличиваем счетчик попыток
-        attempts += 1
-        await state.update_data(verification_attempts=attempts)
-        
+    if result.status == CODE_INVALID:
         # Отправляем сообщение об ошибке с указанием оставшихся попыток
-        remaining_attempts = 5 - attempts
         error_message = await message.answer(
             f"❌ Неверный код подтверждения!\n\n"
-            f"Осталось попыток: {remaining_attempts}\n"
+            f"Осталось попыток: {result.attempts_left}\n"
             "Пожалуйста, проверьте код и попробуйте снова.",
             show_alert=True
         )
@@ -759,32 +688,27 @@ async def process_verification(message: types.Message, state: FSMContext):
         return
     
     # Если код верный, удаляем все предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с запросом кода
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
+    await message_cleaner.delete(message.bot, message.chat.id, error_message_ids)
     
     # Очищаем список ID сообщений об ошибках
     await state.update_data(error_message_ids=[])
     
     # Код верный, завершаем регистрацию
     user_id = message.from_user.id
-    db.update_user_field(user_id, 'name', state_data['name'])
-    db.update_user_field(user_id, 'contact', state_data['contact'])
-    db.update_user_field(user_id, 'password', state_data['password'])
-    db.complete_registration(user_id)
+    password_hash = state_data['password']
+    if not is_password_hash(password_hash):
+        # Регистрация начата до того, как пароль стал храниться в FSM хэшем
+        password_hash = await password_hasher.hash(password_hash)
+    await db.finalize_registration(
+        user_id,
+        state_data['name'],
+        state_data['contact'],
+        password_hash
+    )
     
-    # Clear state and show welcome message
+    # Show welcome message in place of the code request and clear state
+    await registration_view.show(message.bot, message.chat.id, state, "Привет! Вы успешно зарегистрировались!")
     await state.clear()
-    await message.answer("Привет! Вы успешно зарегистрировались!")
 
 # Этот обработчик должен быть последним, чтобы не перехватывать команды
 @dp.message(F.text)
@@ -805,11 +729,11 @@ async def delete_unexpected_messages(message: types.Message, state: FSMContext):
 
 # Добавляем новый обработчик для получения контакта
 @dp.message(RegistrationStates.WAITING_CONTACT, F.contact)
+@staged_state
 async def process_contact_button(message: types.Message, state: FSMContext):
     """Process contact shared via button"""
     # Получаем данные состояния
     state_data = await state.get_data()
-    bot_message_id = state_data.get('bot_message_id')
     error_message_ids = state_data.get('error_message_ids', [])
     current_contact = state_data.get('contact')
     
@@ -827,9 +751,7 @@ async def process_contact_button(message: types.Message, state: FSMContext):
         error_message = await message.answer(
             "❌ Вы ввели тот же номер телефона!\n\n"
             "Пожалуйста, введите другой номер или email, или вернитесь назад.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="« Назад", callback_data="reg_back")
-            ]])
+            reply_markup=BACK_KEYBOARD
         )
         # Сохраняем ID сообщения об ошибке
         error_message_ids.append(error_message.message_id)
@@ -839,26 +761,8 @@ async def process_contact_button(message: types.Message, state: FSMContext):
     # Получаем ID последних сообщений бота
     last_messages = state_data.get('last_messages', [])
     
-    # Удаляем сообщение с просьбой нажать на кнопку и само сообщение с кнопкой
-    for msg_id in last_messages:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except:
-            pass
-    
-    # Удаляем предыдущее сообщение бота с инлайн кнопками
-    if bot_message_id:
-        try:
-            await message.bot.delete_message(message.chat.id, bot_message_id)
-        except:
-            pass
-    
-    # Удаляем предыдущие сообщения об ошибках
-    for error_id in error_message_ids:
-        try:
-            await message.bot.delete_message(message.chat.id, error_id)
-        except:
-            pass
+    # Удаляем сообщение с кнопкой и предыдущие сообщения об ошибках
+    await message_cleaner.delete(message.bot, message.chat.id, last_messages, error_message_ids)
     
     # Проверяем валидность номера
     is_valid, error_msg = is_valid_phone(phone)
@@ -866,9 +770,7 @@ async def process_contact_button(message: types.Message, state: FSMContext):
         error_message = await message.answer(
             f"❌ Ваш номер не соответствует требованиям:\n{error_msg}\n\n"
             "Пожалуйста, введите другой номер телефона или email:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="« Назад", callback_data="reg_back")
-            ]])
+            reply_markup=BACK_KEYBOARD
         )
         # Сохраняем ID сообщения об ошибке
         error_message_ids.append(error_message.message_id)
@@ -883,14 +785,115 @@ async def process_contact_button(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     
     # Показываем обновленное меню регистрации
-    await message.answer(
+    await registration_view.show(
+        message.bot, message.chat.id, state,
         "Пожалуйста, заполните оставшиеся поля:",
-        reply_markup=get_registration_keyboard(user_data)
+        get_registration_keyboard(user_data)
     )
 
+@dp.startup()
+async def on_startup(shard_index: int = None, shard_count: int = 1):
+    """Start background services (polling and webhook modes)"""
+    if METRICS_PORT:
+        if shard_index is not None:
+            metrics_server.port = METRICS_PORT + 1 + shard_index
+        await metrics_server.start()
+    db.start_background_tasks()
+    # Калибровка стоимости хэша на этой машине в уже запущенном пуле
+    await password_hasher.start()
+    verification.start_background_tasks()
+    # Воркер шарда отправляет коды только своих чатов: on_delivery_failed пишет FSM через его кэш
+    delivery.start(shard_index, shard_count)
+
+@dp.shutdown()
+async def on_shutdown():
+    """Stop background services and flush buffered writes"""
+    await delivery.close()
+    await dp.fsm.close()
+    await verification.close()
+    await db.close()
+    email_domain_cache.close()
+    await metrics_server.close()
+
+# Без секрета вебхук принимал бы POST от кого угодно. Случайный секрет годится: set_webhook
+# при каждом запуске сообщает Telegram текущий
+webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+def create_webhook_app() -> web.Application:
+    """Build the aiohttp application serving Telegram updates for the dispatcher"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=webhook_secret
+    ).register(app, path=WEBHOOK_PATH)
+    # Запуск и остановка приложения вызывают startup/shutdown диспетчера
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def wait_for_stop_signal():
+    """Wait for SIGINT/SIGTERM (stops as gracefully as start_polling)"""
+    stop = asyncio.Event()
+    if sys.platform != "win32":
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+async def run_webhook(app: web.Application):
+    """Serve updates over webhook until the process is interrupted"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=webhook_secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logging.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # Корректное завершение: ждем обработчики и вызываем shutdown диспетчера
+        await runner.cleanup()
+
+async def run_sharded():
+    """Receive updates in this process and handle them in SHARD_WORKERS worker processes"""
+    supervisor = ShardSupervisor(SHARD_WORKERS)
+    supervisor.start()
+    logging.info(f"Started {SHARD_WORKERS} shard workers")
+    # Этот процесс только маршрутизирует: на METRICS_PORT - его счетчики, обработчики - в воркерах
+    REGISTRY.add_collector('shards', supervisor.stats)
+    if METRICS_PORT:
+        await metrics_server.start()
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(supervisor.create_webhook_app(WEBHOOK_PATH, webhook_secret))
+        else:
+            polling = asyncio.create_task(
+                supervisor.run_polling(bot, allowed_updates=dp.resolve_used_update_types())
+            )
+            try:
+                await wait_for_stop_signal()
+            finally:
+                polling.cancel()
+    finally:
+        # Воркеры дообрабатывают принятые апдейты и вызывают shutdown своих диспетчеров
+        supervisor.stop()
+        logging.info(f"Shard workers stopped, routed updates: {supervisor.stats()['routed']}")
+        await metrics_server.close()
+        await bot.session.close()
+
 async def main():
     """Main function to start the bot"""
-    await dp.start_polling(bot)
+    if SHARD_WORKERS > 1:
+        await run_sharded()
+    elif WEBHOOK_URL:
+        await run_webhook(create_webhook_app())
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     if sys.platform == "win32":
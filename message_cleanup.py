@@ -0,0 +1,80 @@
+#Secondary bot file that is responsible for removing stale bot/user messages (errors, prompts) from chats.
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from aiogram import Bot
+
+# Ограничение Bot API на число сообщений в одном вызове deleteMessages
+DELETE_MESSAGES_LIMIT = 100
+
+class MessageCleaner:
+    """Deletes batches of messages with deleteMessages, falling back to bounded parallel deletes
+
+    deleteMessages succeeds even when some ids could not be deleted and does not say which, so ids
+    sent in a successful batch are counted as requested; deleted and failed come from single deletes only.
+    """
+
+    def __init__(self, concurrency: int = 5):
+        self.concurrency = concurrency
+        self.requested = 0
+        self.deleted = 0
+        self.failed = 0
+        self.batch_calls = 0
+        self.single_calls = 0
+
+    async def delete(self, bot: Bot, chat_id: int, *groups: Iterable[Optional[int]]) -> int:
+        """Delete every message id from the given groups (None values are skipped)
+
+        Returns the number of ids accepted by deleteMessages plus those confirmed by single deletes.
+        """
+        message_ids: List[int] = []
+        for group in groups:
+            for message_id in group:
+                if message_id and message_id not in message_ids:
+                    message_ids.append(message_id)
+
+        requested = 0
+        deleted = 0
+        for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+            chunk = message_ids[start:start + DELETE_MESSAGES_LIMIT]
+            try:
+                self.batch_calls += 1
+                # deleteMessages молча пропускает сообщения, которые удалить нельзя
+                await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                requested += len(chunk)
+            except Exception as e:
+                logging.warning(f"Batch delete of {len(chunk)} messages in chat {chat_id} failed: {e}")
+                deleted += await self._delete_one_by_one(bot, chat_id, chunk)
+
+        self.requested += requested
+        self.deleted += deleted
+        return requested + deleted
+
+    async def _delete_one_by_one(self, bot: Bot, chat_id: int, message_ids: List[int]) -> int:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def delete_message(message_id: int) -> bool:
+            async with semaphore:
+                self.single_calls += 1
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=message_id)
+                    return True
+                except Exception as e:
+                    self.failed += 1
+                    logging.warning(f"Failed to delete message {message_id} in chat {chat_id}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(delete_message(message_id) for message_id in message_ids))
+        return sum(results)
+
+    def stats(self) -> Dict[str, int]:
+        """Return deletion counters"""
+        return {
+            'requested': self.requested,
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'batch_calls': self.batch_calls,
+            'single_calls': self.single_calls,
+        }
@@ -0,0 +1,217 @@
+#Secondary bot file that is responsible for metrics: latency histograms, counters and a Prometheus text endpoint.
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+# Границы корзин гистограмм задержки, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: Any, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense; each label set keeps bucket counts, sum and count
+
+    observe() is cheap (one bisect, three additions); cumulative sums are built only when rendering.
+    Database timers observe from the database thread, so updates and snapshots take a lock.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам (+Inf последней), сумма, количество]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: Any):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: Any) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        # Снимок под локом, форматирование - уже без него
+        with self._lock:
+            snapshot = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+class Registry:
+    """Set of metrics plus stats() collectors rendered together in the text exposition format"""
+
+    def __init__(self, prefix: str = 'bot'):
+        self.prefix = prefix
+        self._metrics: list = []
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(f'{self.prefix}_{name}', documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f'{self.prefix}_{name}', documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, Any]]):
+        """Expose the numbers of an existing stats() method as gauges named <prefix>_<name>_<key>"""
+        self._collectors[name] = collect
+
+    def _render_collector(self, name: str, stats: Dict[str, Any]) -> List[str]:
+        lines = []
+        for key, value in stats.items():
+            metric = f'{self.prefix}_{name}_{key}'
+            # Вложенные словари и списки (счетчики по действиям, по воркерам) - через метку key
+            if isinstance(value, dict):
+                items = [(f'{{key="{_escape(k)}"}}', v) for k, v in value.items()]
+            elif isinstance(value, (list, tuple)):
+                items = [(f'{{key="{index}"}}', v) for index, v in enumerate(value)]
+            else:
+                items = [('', value)]
+            numeric = [(labels, v) for labels, v in items if isinstance(v, (int, float)) and not isinstance(v, bool)]
+            if numeric:
+                lines.append(f'# TYPE {metric} gauge')
+                lines.extend(f'{metric}{labels} {v}' for labels, v in numeric)
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, collect in self._collectors.items():
+            try:
+                lines.extend(self._render_collector(name, collect()))
+            except Exception as e:
+                logging.warning(f"Metrics collector {name} failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram('handler_latency_seconds', 'Handler run time', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('handler_errors_total', 'Handler exceptions', ('handler',))
+DB_QUERY_LATENCY = REGISTRY.histogram('db_query_seconds', 'Database method run time on the database thread', ('method',))
+DB_QUEUE_WAIT = REGISTRY.histogram('db_queue_wait_seconds', 'Time a database call waited for the database thread')
+PROVIDER_LATENCY = REGISTRY.histogram(
+    'provider_latency_seconds', 'Email, SMS and DNS call time', ('provider', 'result'),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+def observe_latency(histogram: Histogram, provider: str, success: Callable[[Any], bool] = bool):
+    """Decorator for coroutine functions: record run time with result ok/failed/error"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = 'error'
+            try:
+                value = await func(*args, **kwargs)
+                result = 'ok' if success(value) else 'failed'
+                return value
+            finally:
+                histogram.observe(time.perf_counter() - started, provider, result)
+        return wrapper
+    return decorator
+
+class MetricsMiddleware(BaseMiddleware):
+    """Inner middleware that records latency and errors of the handler chosen for each event"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+class MetricsServer:
+    """Small aiohttp server with GET /metrics in the Prometheus text format"""
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = '127.0.0.1', port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Metrics endpoint on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
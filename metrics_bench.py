@@ -0,0 +1,104 @@
+#Helper script that measures what the metrics middleware and database timers add to each update.
+
+import argparse
+import asyncio
+import time
+from functools import partial
+
+from aiogram import Bot, Dispatcher, types
+
+from database import _timed_call
+from metrics import DB_QUERY_LATENCY, REGISTRY, MetricsMiddleware
+
+bot = Bot(token="123456:benchmark")
+
+def make_dispatcher(with_metrics: bool) -> Dispatcher:
+    dp = Dispatcher()
+    if with_metrics:
+        dp.message.middleware(MetricsMiddleware())
+
+    @dp.message()
+    async def echo_length(message: types.Message):
+        """Trivial handler, so the difference is the middleware itself"""
+        return len(message.text)
+
+    return dp
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 100000 + update_id % 1000, 'type': 'private'},
+            'from': {'id': 100000 + update_id % 1000, 'is_bot': False, 'first_name': 'Bench'},
+            'text': 'hello',
+        },
+    }
+
+async def feed(dp: Dispatcher, updates: list) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_raw_update(bot, update)
+    return time.perf_counter() - started
+
+def noop():
+    return None
+
+def keyword_noop(**fields):
+    return None
+
+async def handler(event, data):
+    return None
+
+async def middleware_cost(total: int) -> float:
+    """Time of the middleware wrapper alone: the end-to-end difference is within update noise"""
+    middleware = MetricsMiddleware()
+    data = {}
+    started = time.perf_counter()
+    for _ in range(total):
+        await handler(None, data)
+    direct = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(total):
+        await middleware(handler, None, data)
+    return (time.perf_counter() - started - direct) / total
+
+async def run(total: int, rounds: int):
+    updates = [make_update(update_id) for update_id in range(total)]
+    plain, measured = make_dispatcher(False), make_dispatcher(True)
+    # Лучший из нескольких прогонов, чередуя варианты, чтобы шум не попал в разницу
+    best_plain = best_measured = float('inf')
+    for _ in range(rounds):
+        best_plain = min(best_plain, await feed(plain, updates))
+        best_measured = min(best_measured, await feed(measured, updates))
+    per_plain = best_plain / total * 1e6
+    per_measured = best_measured / total * 1e6
+    print(f"update without metrics: {per_plain:.1f}us")
+    print(f"update with metrics:    {per_measured:.1f}us ({per_measured - per_plain:+.2f}us)")
+
+    print(f"middleware alone: {await middleware_cost(total * 10) * 1e6:.2f}us")
+
+    started = time.perf_counter()
+    for _ in range(total):
+        _timed_call(time.perf_counter(), noop)
+    print(f"database call timer: {(time.perf_counter() - started) / total * 1e6:.2f}us")
+
+    # Вызовы с именованными аргументами приходят в поток базы как partial (update_user_fields)
+    started = time.perf_counter()
+    for _ in range(total):
+        _timed_call(time.perf_counter(), partial(keyword_noop, name='bench'))
+    print(f"database call timer (partial): {(time.perf_counter() - started) / total * 1e6:.2f}us")
+    assert DB_QUERY_LATENCY.count('keyword_noop') == total
+
+    started = time.perf_counter()
+    body = REGISTRY.render()
+    print(f"/metrics render: {(time.perf_counter() - started) * 1e3:.2f}ms, {len(body)} bytes")
+    await bot.session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-update overhead of the metrics middleware")
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.rounds))
@@ -0,0 +1,180 @@
+#Secondary bot file with aiogram middlewares: per-update accounting and flood control around the handlers.
+
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from fsm_storage import update_storage_ops
+from rate_limit import TokenBucket
+
+class StorageOpsMiddleware(BaseMiddleware):
+    """Outer middleware that counts FSM storage operations made while handling each update"""
+
+    def __init__(self):
+        self.updates = 0
+        self.operations = 0
+        self.max_per_update = 0
+        self.last_per_update = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        counter = [0]
+        token = update_storage_ops.set(counter)
+        try:
+            return await handler(event, data)
+        finally:
+            update_storage_ops.reset(token)
+            self.updates += 1
+            self.operations += counter[0]
+            self.last_per_update = counter[0]
+            self.max_per_update = max(self.max_per_update, counter[0])
+            logging.debug(f"FSM storage operations for update: {counter[0]}")
+
+    def stats(self) -> Dict[str, float]:
+        """Return per-update storage operation counters"""
+        return {
+            'updates': self.updates,
+            'operations': self.operations,
+            'avg_per_update': self.operations / self.updates if self.updates else 0.0,
+            'max_per_update': self.max_per_update,
+            'last_per_update': self.last_per_update,
+        }
+
+ACTION_START = 'start'
+ACTION_COMPLETE = 'complete'
+ACTION_MESSAGE = 'message'
+ACTION_CALLBACK = 'callback'
+
+# Лимиты на пользователя: (действий в секунду, размер всплеска)
+DEFAULT_ACTION_LIMITS = {
+    ACTION_START: (0.2, 3.0),
+    ACTION_COMPLETE: (0.1, 3.0),
+    ACTION_MESSAGE: (1.0, 5.0),
+    ACTION_CALLBACK: (2.0, 10.0),
+}
+# Действия, которые ходят в базу, DNS, SMTP/SMS и Telegram API
+EXPENSIVE_ACTIONS = frozenset({ACTION_START, ACTION_COMPLETE, ACTION_MESSAGE})
+
+def update_action(update: Update) -> Optional[str]:
+    """Classify an update for flood control (None - not limited)"""
+    if update.message is not None:
+        text = update.message.text or ''
+        return ACTION_START if text.startswith('/start') else ACTION_MESSAGE
+    if update.callback_query is not None:
+        return ACTION_COMPLETE if update.callback_query.data == 'reg_complete' else ACTION_CALLBACK
+    return None
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Outer middleware that drops updates over per-user/per-action token buckets or the global cap
+
+    Buckets live in one OrderedDict in last-use order; a bucket idle for longer than
+    it takes to refill completely is the same as a new one, so it is evicted.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_concurrent: int = 100, defer_timeout: float = 0.5, max_buckets: int = 100000):
+        self.limits = {**DEFAULT_ACTION_LIMITS, **(limits or {})}
+        # Через столько секунд простоя корзина снова полная
+        self.idle_ttl = {action: capacity / rate for action, (rate, capacity) in self.limits.items()}
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+        self.max_concurrent = max_concurrent
+        self.defer_timeout = defer_timeout
+        self._expensive = asyncio.Semaphore(max_concurrent)
+
+        self.passed = 0
+        self.throttled: Counter = Counter()
+        self.deferred = 0
+        self.dropped_busy = 0
+        self.evicted = 0
+
+    def _bucket(self, user_id: int, action: str, now: float) -> TokenBucket:
+        key = (user_id, action)
+        # Вытесняем до поиска: возвращенная корзина не должна тут же пропасть вместе с расходом токена
+        self._evict(now, room=0 if key in self._buckets else 1)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, capacity = self.limits[action]
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now: float, room: int = 0):
+        buckets = self._buckets
+        limit = self.max_buckets - room
+        # Самые давно использованные корзины - в начале словаря
+        while buckets:
+            (_, action), oldest = next(iter(buckets.items()))
+            if len(buckets) <= limit and now - oldest.updated_at < self.idle_ttl[action]:
+                break
+            buckets.popitem(last=False)
+            self.evicted += 1
+
+    @staticmethod
+    async def _drop(event: Update):
+        # Без ответа на callback query клиент крутит индикатор загрузки до таймаута
+        if event.callback_query is not None:
+            try:
+                await event.callback_query.answer()
+            except Exception as e:
+                logging.warning(f"Failed to answer dropped callback query: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action = update_action(event) if isinstance(event, Update) else None
+        user = data.get('event_from_user')
+        if action is None or user is None:
+            return await handler(event, data)
+
+        if not self._bucket(user.id, action, time.monotonic()).try_acquire():
+            # Апдейт сверх лимита пользователя отбрасываем без обращения к обработчикам
+            self.throttled[action] += 1
+            logging.debug(f"Throttled {action} update from user {user.id}")
+            await self._drop(event)
+            return None
+
+        if action not in EXPENSIVE_ACTIONS:
+            self.passed += 1
+            return await handler(event, data)
+
+        if self._expensive.locked():
+            # Все слоты заняты: коротко ждем освобождения, иначе сбрасываем апдейт
+            self.deferred += 1
+            try:
+                await asyncio.wait_for(self._expensive.acquire(), self.defer_timeout)
+            except asyncio.TimeoutError:
+                self.dropped_busy += 1
+                await self._drop(event)
+                return None
+        else:
+            await self._expensive.acquire()
+        try:
+            self.passed += 1
+            return await handler(event, data)
+        finally:
+            self._expensive.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return flood control counters"""
+        return {
+            'passed': self.passed,
+            'throttled': dict(self.throttled),
+            'deferred': self.deferred,
+            'dropped_busy': self.dropped_busy,
+            'buckets': len(self._buckets),
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,87 @@
+#Secondary bot file that is responsible for rejecting known leaked passwords with a memory-mapped Bloom filter.
+
+import hashlib
+import logging
+import math
+import mmap
+import struct
+from typing import Iterable, Optional
+
+# Заголовок файла: сигнатура, размер битового массива (бит), число хэш-функций, число слов
+HEADER = struct.Struct('<4sQII')
+MAGIC = b'BLM1'
+
+def _indexes(password: str, bits: int, hashes: int) -> Iterable[int]:
+    # Двойное хэширование: k позиций из двух 64-битных половин одного blake2b
+    digest = hashlib.blake2b(password.encode('utf-8'), digest_size=16).digest()
+    h1, h2 = struct.unpack('<QQ', digest)
+    h2 |= 1
+    return ((h1 + i * h2) % bits for i in range(hashes))
+
+def filter_parameters(count: int, false_positive_rate: float) -> tuple:
+    """Return (bits, hashes) for count items at the given false positive rate"""
+    bits = max(8, math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / max(count, 1) * math.log(2)))
+    return bits, hashes
+
+def build_filter(passwords: Iterable[str], count: int, path: str, false_positive_rate: float = 0.001) -> int:
+    """Write a Bloom filter for the passwords to path; returns the number of passwords added"""
+    bits, hashes = filter_parameters(count, false_positive_rate)
+    array = bytearray((bits + 7) // 8)
+    added = 0
+    for password in passwords:
+        for index in _indexes(password, bits, hashes):
+            array[index >> 3] |= 1 << (index & 7)
+        added += 1
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, bits, hashes, added))
+        f.write(array)
+    return added
+
+class PasswordFilter:
+    """Read-only Bloom filter of leaked passwords, mapped into memory instead of being loaded"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            # Страницы файла подгружаются ОС по мере обращения и делятся между процессами
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check(path)
+        except ValueError:
+            self._map.close()
+            raise
+
+    def _check(self, path: str):
+        # Обрезанный файл иначе дал бы IndexError в __contains__ на каждом пароле
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is too short for a password filter header")
+        magic, self.bits, self.hashes, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a password filter file")
+        if not self.bits or not self.hashes:
+            raise ValueError(f"{path} has an empty bit array or no hash functions")
+        expected = HEADER.size + (self.bits + 7) // 8
+        if len(self._map) < expected:
+            raise ValueError(f"{path} is truncated: {len(self._map)} bytes, expected {expected}")
+
+    def __contains__(self, password: str) -> bool:
+        data = self._map
+        offset = HEADER.size
+        for index in _indexes(password, self.bits, self.hashes):
+            if not data[offset + (index >> 3)] & (1 << (index & 7)):
+                return False
+        return True
+
+    def close(self):
+        self._map.close()
+
+def open_filter(path: str) -> Optional[PasswordFilter]:
+    """Open the filter file, or return None if it has not been built or is damaged"""
+    try:
+        return PasswordFilter(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        # mmap пустого файла тоже ValueError; бот должен стартовать и без фильтра
+        logging.warning(f"Password filter {path} is unusable, leaked password check disabled: {e}")
+        return None
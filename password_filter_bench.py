@@ -0,0 +1,45 @@
+#Helper script that measures leaked password filter lookup latency and resident memory.
+
+import argparse
+import os
+import tempfile
+import time
+
+from password_filter import PasswordFilter, build_filter
+
+def rss_kib() -> int:
+    """Resident set size of this process (Linux)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the leaked password Bloom filter")
+    parser.add_argument('--words', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--fp', type=float, default=0.001)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.bloom')
+    started = time.perf_counter()
+    build_filter((f'leaked{i}' for i in range(args.words)), args.words, path, args.fp)
+    print(f"built {args.words} words in {time.perf_counter() - started:.1f}s, file {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+
+    probes = [f'leaked{i * 7 % args.words}' for i in range(args.lookups // 2)]
+    probes += [f'Unique#{i}pass' for i in range(args.lookups // 2)]
+
+    before = rss_kib()
+    password_filter = PasswordFilter(path)
+    opened = rss_kib()
+    started = time.perf_counter()
+    hits = sum(1 for probe in probes if probe in password_filter)
+    elapsed = time.perf_counter() - started
+    after = rss_kib()
+
+    false_positives = hits - args.lookups // 2
+    print(f"lookup: {elapsed / len(probes) * 1e6:.2f}us, false positives: {false_positives / (args.lookups // 2):.4%}")
+    print(f"RSS: +{opened - before} KiB after mmap, +{after - before} KiB after {len(probes)} lookups")
+    password_filter.close()
+    os.remove(path)
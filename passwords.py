@@ -0,0 +1,134 @@
+#Secondary bot file that is responsible for password hashing (scrypt) in a process pool, off the event loop.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+HASH_SCHEME = 'scrypt'
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+# Нижняя и верхняя граница параметра стоимости N (степени двойки)
+MIN_WORK_FACTOR = 2 ** 14
+MAX_WORK_FACTOR = 2 ** 20
+# Сколько времени при калибровке должен занимать один хэш
+DEFAULT_TARGET_TIME = 0.1
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # scrypt расходует 128 * n * r байт памяти; maxmem по умолчанию (32 МиБ) меньше нужного при больших n
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r + 1024 * 1024, dklen=HASH_SIZE
+    )
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+def hash_password(password: str, n: int = MIN_WORK_FACTOR, r: int = 8, p: int = 1) -> str:
+    """Hash a password with a random salt; returns 'scrypt$n$r$p$salt$hash'"""
+    salt = os.urandom(SALT_SIZE)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{HASH_SCHEME}${n}${r}${p}${_b64encode(salt)}${_b64encode(digest)}"
+
+def check_password(password: str, encoded: str) -> bool:
+    """Check a password against a hash produced by hash_password (its own parameters are used)"""
+    try:
+        scheme, n, r, p, salt, digest = encoded.split('$')
+        if scheme != HASH_SCHEME:
+            return False
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+def is_password_hash(value: str) -> bool:
+    """Tell hashes apart from passwords stored before hashing was introduced"""
+    return value.startswith(HASH_SCHEME + '$')
+
+def _time_hash(n: int, r: int, p: int) -> float:
+    started = time.perf_counter()
+    _scrypt('calibration', os.urandom(SALT_SIZE), n, r, p)
+    return time.perf_counter() - started
+
+class PasswordHasher:
+    """Hashes and checks passwords in a process pool; the work factor is calibrated on start()"""
+
+    def __init__(self, workers: Optional[int] = None, work_factor: Optional[int] = None,
+                 r: int = 8, p: int = 1, target_time: float = DEFAULT_TARGET_TIME):
+        self.workers = workers
+        self.work_factor = work_factor
+        self.r = r
+        self.p = p
+        self.target_time = target_time
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # fork: при spawn дочерние процессы заново импортируют main.py (бот, БД, хранилище)
+            fork = 'fork' in multiprocessing.get_all_start_methods()
+            if fork and threading.active_count() > 1:
+                # fork копирует блокировки чужих потоков в занятом состоянии - возможен deadlock
+                logging.warning("Password pool is forked while other threads run; call prestart() before starting them")
+            context = multiprocessing.get_context('fork') if fork else None
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def prestart(self):
+        """Fork all pool processes now; call it before the process starts any threads"""
+        # С fork ProcessPoolExecutor запускает все процессы при первой задаче, до своего служебного потока
+        self._pool().submit(os.getpid).result()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(), func, *args)
+
+    async def start(self):
+        """Start the pool and pick the work factor if it was not set explicitly"""
+        if self.work_factor is None:
+            self.work_factor = await self.calibrate()
+
+    async def calibrate(self) -> int:
+        """Double N until one hash in the pool takes at least target_time"""
+        n = MIN_WORK_FACTOR
+        while True:
+            elapsed = await self._run(_time_hash, n, self.r, self.p)
+            if elapsed >= self.target_time or n >= MAX_WORK_FACTOR:
+                break
+            n *= 2
+        logging.info(f"Password hashing work factor: N={n} ({elapsed * 1000:.0f}ms per hash)")
+        return n
+
+    async def hash(self, password: str) -> str:
+        """Hash a password without blocking the event loop"""
+        if self.work_factor is None:
+            await self.start()
+        return await self._run(hash_password, password, self.work_factor, self.r, self.p)
+
+    async def verify(self, password: str, encoded: str) -> bool:
+        """Check a password against a stored hash without blocking the event loop"""
+        return await self._run(check_password, password, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """Tell whether a hash is weaker than the current parameters"""
+        if not is_password_hash(encoded):
+            return True
+        try:
+            _, n, r, p, _, _ = encoded.split('$')
+            return int(n) < (self.work_factor or MIN_WORK_FACTOR) or (int(r), int(p)) != (self.r, self.p)
+        except ValueError:
+            return True
+
+    def close(self):
+        """Stop pool processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,70 @@
+#Secondary bot file that is responsible for phone numbers: normalization and validation shared by the bot and verification.
+
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+import phonenumbers
+
+# Паттерн для проверки украинского номера телефона
+PHONE_PATTERN = re.compile(r'^(?:\+?38)?0\d{9}$')
+PHONE_FORMAT_ERROR = "Неверный формат номера телефона"
+
+class PhoneInfo(NamedTuple):
+    """Result of phone number normalization and validation"""
+    e164: Optional[str]
+    region: Optional[str]
+    number_type: Optional[int]
+    is_valid: bool
+    error: str
+
+def normalize_phone(phone: str) -> str:
+    """Bring a Ukrainian number to the +38... form"""
+    if not phone.startswith('+'):
+        if phone.startswith('38'):
+            return '+' + phone
+        return '+38' + phone
+    return phone
+
+@lru_cache(maxsize=4096)
+def normalize_and_classify_phone(phone: str) -> PhoneInfo:
+    """Parse phone number once and return its E.164 form, region, type and verdict"""
+    if not PHONE_PATTERN.match(phone):
+        return PhoneInfo(None, None, None, False, PHONE_FORMAT_ERROR)
+
+    try:
+        phone_number = phonenumbers.parse(normalize_phone(phone))
+        e164 = phonenumbers.format_number(phone_number, phonenumbers.PhoneNumberFormat.E164)
+        region = phonenumbers.region_code_for_number(phone_number)
+        number_type = phonenumbers.number_type(phone_number)
+
+        def result(is_valid: bool, error: str = "") -> PhoneInfo:
+            return PhoneInfo(e164, region, number_type, is_valid, error)
+
+        # Проверяем регион (должен быть Украина)
+        if region != 'UA':
+            return result(False, "Номер телефона должен быть украинским")
+
+        # Проверяем, существует ли такой номер
+        if not phonenumbers.is_valid_number(phone_number):
+            return result(False, "Такой номер телефона не существует")
+
+        # Проверяем, является ли номер мобильным
+        if number_type != phonenumbers.PhoneNumberType.MOBILE:
+            return result(False, "Номер телефона должен быть мобильным")
+
+        # Проверяем возможность существования номера
+        if not phonenumbers.is_possible_number(phone_number):
+            return result(False, "Номер телефона не может существовать в указанном регионе")
+
+        return result(True)
+    except Exception:
+        return PhoneInfo(None, None, None, False, "Ошибка при проверке номера телефона")
+
+def is_valid_phone(phone: str) -> tuple[bool, str]:
+    """
+    Validate phone number and check if it exists
+    Returns: (is_valid, error_message)
+    """
+    info = normalize_and_classify_phone(phone)
+    return info.is_valid, info.error
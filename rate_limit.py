@@ -0,0 +1,41 @@
+#Secondary bot file with rate limiting primitives shared by outbound delivery and incoming updates.
+
+import asyncio
+import time
+from typing import Callable
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, bursts up to capacity"""
+
+    # Без __dict__: корзин на пользователей может быть много
+    __slots__ = ('rate', 'capacity', '_clock', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available right now"""
+        self._refill(self._clock())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Seconds until tokens become available (0 if they already are)"""
+        self._refill(self._clock())
+        missing = tokens - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else float('inf')
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until tokens are available and take them"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
@@ -0,0 +1,101 @@
+#Secondary bot file that is responsible for the registration menu message: one message per chat, edited in place.
+
+import hashlib
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup
+
+def _digest(value: str) -> str:
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+
+def render_fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> list:
+    """Return [text digest, markup digest] of rendered content (stable across processes)"""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ''
+    return [_digest(text), _digest(markup)]
+
+class RegistrationView:
+    """Tracks the registration menu message of a chat (bot_message_id) and edits it instead of resending
+
+    The fingerprint of what the message shows is kept next to its id in FSM data,
+    so unchanged content costs no API call at all.
+    """
+
+    def __init__(self):
+        self.edited = 0
+        self.markup_edited = 0
+        self.skipped = 0
+        self.sent = 0
+        self.edit_failed = 0
+
+    async def show(self, bot: Bot, chat_id: int, state: FSMContext, text: str,
+                   reply_markup: Optional[InlineKeyboardMarkup] = None,
+                   message_id: Optional[int] = None) -> int:
+        """Show text and keyboard in the menu message (message_id, if the update points at a specific one)"""
+        data = await state.get_data()
+        current_id = data.get('bot_message_id')
+        if message_id is None:
+            message_id = current_id
+        fingerprint = render_fingerprint(text, reply_markup)
+        # Отпечаток относится только к сообщению, id которого сохранен рядом с ним
+        rendered = data.get('bot_message_render') if message_id == current_id else None
+
+        if message_id and rendered == fingerprint:
+            self.skipped += 1
+            return message_id
+
+        if message_id and not await self._edit(bot, chat_id, message_id, text, reply_markup, rendered, fingerprint):
+            message_id = None
+
+        if not message_id:
+            # Редактировать нечего (или нельзя) - отправляем новое сообщение
+            message = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+            message_id = message.message_id
+            self.sent += 1
+
+        await state.update_data(bot_message_id=message_id, bot_message_render=fingerprint)
+        return message_id
+
+    async def send(self, bot: Bot, chat_id: int, state: FSMContext, text: str,
+                   reply_markup: Optional[InlineKeyboardMarkup] = None) -> int:
+        """Send a new menu message and track it from now on"""
+        message = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+        self.sent += 1
+        await state.update_data(
+            bot_message_id=message.message_id,
+            bot_message_render=render_fingerprint(text, reply_markup)
+        )
+        return message.message_id
+
+    async def _edit(self, bot: Bot, chat_id: int, message_id: int, text: str,
+                    reply_markup: Optional[InlineKeyboardMarkup], rendered: Optional[list], fingerprint: list) -> bool:
+        try:
+            if rendered is not None and rendered[0] == fingerprint[0]:
+                # Текст тот же - меняем только клавиатуру
+                await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+                self.markup_edited += 1
+            else:
+                await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+                self.edited += 1
+            return True
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e):
+                # Содержимое уже такое, просто отпечаток был неизвестен
+                self.skipped += 1
+                return True
+            self.edit_failed += 1
+            logging.warning(f"Failed to edit registration message {message_id} in chat {chat_id}: {e}")
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        """Return edit/skip/send counters"""
+        return {
+            'edited': self.edited,
+            'markup_edited': self.markup_edited,
+            'skipped': self.skipped,
+            'sent': self.sent,
+            'edit_failed': self.edit_failed,
+        }
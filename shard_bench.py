@@ -0,0 +1,73 @@
+#Helper script that measures how update throughput scales with the number of shard worker processes.
+
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, types
+from email_validator import EmailNotValidError, validate_email
+
+from phone import normalize_and_classify_phone
+from sharding import ChatSerializer, ShardSupervisor, chat_id_of
+
+# Воркеры импортируют этот модуль как приложение: нужны dp и bot, сеть обработчику не нужна
+bot = Bot(token="123456:benchmark")
+dp = Dispatcher()
+
+@dp.message()
+async def check_contact(message: types.Message):
+    """CPU-bound stand-in for process_contact: phone and email checks on unique inputs"""
+    normalize_and_classify_phone(message.text)
+    try:
+        validate_email(f"user{message.message_id}@example.com", check_deliverability=False)
+    except EmailNotValidError:
+        pass
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    """Build a private-chat message update with a unique phone number"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'Bench {chat_id}'},
+            # Разные номера, чтобы lru_cache не скрывал стоимость разбора
+            'text': f'+38067{update_id % 10000000:07d}',
+        },
+    }
+
+async def run_in_process(updates: list) -> float:
+    serializer = ChatSerializer()
+    started = time.perf_counter()
+    for update in updates:
+        await serializer.submit(chat_id_of(update), lambda update=update: dp.feed_raw_update(bot, update))
+    await serializer.join()
+    return time.perf_counter() - started
+
+async def run_sharded(updates: list, workers: int) -> float:
+    supervisor = ShardSupervisor(workers, app='shard_bench')
+    supervisor.start()
+    started = time.perf_counter()
+    for update in updates:
+        await supervisor.dispatch(update)
+    # stop() ждет, пока воркеры обработают все апдейты из очередей
+    supervisor.stop()
+    return time.perf_counter() - started
+
+async def run(total: int, chats: int, workers_list: list):
+    updates = [make_update(update_id, 100000 + update_id % chats) for update_id in range(total)]
+    elapsed = await run_in_process(updates)
+    print(f"in-process: {total / elapsed:.0f} updates/s")
+    for workers in workers_list:
+        elapsed = await run_sharded(updates, workers)
+        print(f"{workers} workers: {total / elapsed:.0f} updates/s")
+    await bot.session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare update throughput for different numbers of shard workers")
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.chats, args.workers))
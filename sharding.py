@@ -0,0 +1,240 @@
+#Secondary bot file that is responsible for spreading updates over several worker processes, sharded by chat.
+
+import asyncio
+import hmac
+import importlib
+import logging
+import multiprocessing
+import queue
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+# Разделы апдейта, в которых чат лежит не на верхнем уровне
+NESTED_CHAT_KEYS = ('message',)
+# Запасной вариант для апдейтов без чата (inline-запросы, ответы на опросы)
+USER_KEYS = ('from', 'user')
+
+# Сколько апдейтов воркер забирает из очереди за один переход в поток чтения
+READ_BATCH_SIZE = 100
+
+def chat_id_of(update: Dict[str, Any]) -> int:
+    """Return the chat id an update belongs to (the user id if it has no chat, 0 if neither)"""
+    for field, payload in update.items():
+        if field == 'update_id' or not isinstance(payload, dict):
+            continue
+        if 'chat' in payload:
+            return payload['chat']['id']
+        for key in NESTED_CHAT_KEYS:
+            nested = payload.get(key)
+            if isinstance(nested, dict) and 'chat' in nested:
+                return nested['chat']['id']
+        for key in USER_KEYS:
+            if key in payload:
+                return payload[key]['id']
+    return 0
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Pick the worker for a chat; the same chat always goes to the same worker"""
+    return chat_id % shards
+
+class ChatSerializer:
+    """Runs updates of different chats concurrently and updates of one chat strictly in order"""
+
+    def __init__(self, max_in_flight: int = 100):
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks: "set[asyncio.Task]" = set()
+        self.processed = 0
+        self.failed = 0
+
+    async def submit(self, chat_id: int, handler: Callable[[], Awaitable[Any]]):
+        """Schedule handler after the previous update of the same chat (waits if too many are in flight)"""
+        await self._in_flight.acquire()
+        task = asyncio.create_task(self._run(self._tails.get(chat_id), handler))
+        self._tails[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._done(chat_id, done))
+
+    async def _run(self, previous: Optional[asyncio.Task], handler: Callable[[], Awaitable[Any]]):
+        try:
+            if previous is not None:
+                # Ошибка предыдущего апдейта не должна останавливать очередь чата
+                await asyncio.wait([previous])
+            await handler()
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Error handling sharded update: {e}")
+        finally:
+            self._in_flight.release()
+
+    def _done(self, chat_id: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def join(self):
+        """Wait until every submitted update has been handled"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+def _read_batch(updates: multiprocessing.Queue) -> List[Optional[Dict[str, Any]]]:
+    batch = [updates.get()]
+    while batch[-1] is not None and len(batch) < READ_BATCH_SIZE:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+async def _serve_shard(index: int, shards: int, module, updates: multiprocessing.Queue, ready, max_in_flight: int):
+    dp = module.dp
+    bot: Bot = module.bot
+    loop = asyncio.get_running_loop()
+    # Блокирующее чтение из межпроцессной очереди уводим в отдельный поток
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'shard-{index}-queue')
+    serializer = ChatSerializer(max_in_flight)
+
+    # shard_index/shard_count получают только startup-обработчики, объявившие эти параметры
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], shard_index=index, shard_count=shards, **dp.workflow_data)
+    ready.set()
+    logging.info(f"Shard worker {index} started")
+    try:
+        running = True
+        while running:
+            for update in await loop.run_in_executor(reader, _read_batch, updates):
+                if update is None:
+                    running = False
+                    break
+                await serializer.submit(
+                    chat_id_of(update),
+                    lambda update=update: dp.feed_raw_update(bot, update)
+                )
+        await serializer.join()
+    finally:
+        logging.info(f"Shard worker {index} stopping: {serializer.processed} updates, {serializer.failed} failed")
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot], shard_index=index, shard_count=shards, **dp.workflow_data)
+        await bot.session.close()
+        reader.shutdown(wait=False)
+
+def _worker_main(index: int, shards: int, app: str, updates: multiprocessing.Queue, ready, max_in_flight: int):
+    # Ctrl+C приходит всей группе процессов; воркер останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    # При spawn главный модуль родителя уже выполнен здесь как __mp_main__;
+    # если это и есть приложение, используем его, а не создаем второй dp и второе подключение к БД
+    parent_main = sys.modules.get('__mp_main__')
+    if parent_main is not None and Path(getattr(parent_main, '__file__', '')).stem == app:
+        sys.modules.setdefault(app, parent_main)
+    # Модуль с dp и bot импортируется уже в дочернем процессе
+    module = importlib.import_module(app)
+    asyncio.run(_serve_shard(index, shards, module, updates, ready, max_in_flight))
+
+class ShardSupervisor:
+    """Front side of sharded mode: routes raw updates by chat id to worker processes running an app module
+
+    The app module (main.py by default) must expose `dp` and `bot`; each worker
+    imports it, runs the dispatcher startup/shutdown hooks and feeds it updates.
+    """
+
+    def __init__(self, workers: int, app: str = 'main', queue_size: int = 1000, max_in_flight: int = 100):
+        self.workers = workers
+        self.app = app
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight
+        # spawn: воркеры не наследуют соединения и event loop родителя
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._locks: List[asyncio.Lock] = []
+        self.routed = [0] * workers
+
+    def start(self, timeout: float = 60.0):
+        """Start worker processes and wait until each of them has run its startup hooks"""
+        events = []
+        for index in range(self.workers):
+            updates = self._context.Queue(maxsize=self.queue_size)
+            ready = self._context.Event()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, self.workers, self.app, updates, ready, self.max_in_flight),
+                name=f'shard-{index}',
+                daemon=True
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+            events.append(ready)
+        for index, ready in enumerate(events):
+            if not ready.wait(timeout):
+                raise RuntimeError(f"Shard worker {index} did not start in {timeout}s")
+        self._locks = [asyncio.Lock() for _ in range(self.workers)]
+
+    async def dispatch(self, update: Dict[str, Any]):
+        """Send a raw update to the worker owning its chat"""
+        shard = shard_for(chat_id_of(update), self.workers)
+        updates = self._queues[shard]
+        # Лок сохраняет порядок апдейтов одного воркера, даже если очередь заполнена
+        async with self._locks[shard]:
+            try:
+                updates.put_nowait(update)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, updates.put, update)
+        self.routed[shard] += 1
+
+    async def run_polling(self, bot: Bot, allowed_updates: Optional[List[str]] = None, timeout: int = 30):
+        """Long-poll Telegram and route every update until cancelled"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                    request_timeout=timeout + 10
+                )
+            except Exception as e:
+                logging.error(f"Error getting updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.dispatch(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+    def create_webhook_app(self, path: str, secret_token: str) -> web.Application:
+        """Build an aiohttp application that accepts webhook updates carrying secret_token and routes them to workers"""
+        if not secret_token:
+            raise ValueError("Webhook secret token is required")
+
+        async def handle(request: web.Request) -> web.Response:
+            if not hmac.compare_digest(
+                request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token
+            ):
+                return web.Response(status=401, text="Unauthorized")
+            await self.dispatch(await request.json())
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        return app
+
+    def stop(self, timeout: float = 30.0):
+        """Ask workers to finish queued updates, then wait for them to exit"""
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning(f"Shard worker {process.name} did not stop in {timeout}s, terminating")
+                process.terminate()
+                process.join()
+        self._queues = []
+        self._processes = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-worker routing counters"""
+        return {'workers': self.workers, 'routed': list(self.routed)}
@@ -0,0 +1,87 @@
+#Secondary bot file that is responsible for delivering SMS: a long-lived Twilio REST client with an outbound queue.
+
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+import aiohttp
+
+TWILIO_API_BASE = "https://api.twilio.com"
+
+class SMSSender:
+    """Queues outbound SMS and sends them over one pooled HTTP session with bounded concurrency"""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, concurrency: int = 4,
+                 queue_size: int = 1000, timeout: float = 10.0, api_base: str = TWILIO_API_BASE):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.api_base = api_base.rstrip('/')
+
+        self._queue_size = queue_size
+        self._queue: Optional["asyncio.Queue[Tuple[str, str, asyncio.Future]]"] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._workers: "list[asyncio.Task]" = []
+
+    @property
+    def messages_url(self) -> str:
+        return f"{self.api_base}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+    def start(self):
+        """Open the HTTP session and start sender tasks on the running loop"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.account_sid, self.auth_token),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def submit(self, to: str, body: str) -> "asyncio.Future[bool]":
+        """Queue a message and return a future resolved with the delivery result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((to, body, future))
+        except asyncio.QueueFull:
+            logging.warning(f"SMS queue is full, dropping message to {to}")
+            future.set_result(False)
+        return future
+
+    async def _worker(self):
+        while True:
+            to, body, future = await self._queue.get()
+            try:
+                result = await self._send(to, body)
+            except Exception as e:
+                logging.error(f"Error sending SMS to {to}: {e}")
+                result = False
+            finally:
+                self._queue.task_done()
+            if not future.done():
+                future.set_result(result)
+
+    async def _send(self, to: str, body: str) -> bool:
+        """POST one message to the Messages resource"""
+        data = {'To': to, 'From': self.from_number, 'Body': body}
+        async with self._session.post(self.messages_url, data=data) as response:
+            if response.status >= 400:
+                logging.error(f"SMS provider rejected message to {to}: {response.status} {await response.text()}")
+                return False
+            return True
+
+    async def close(self):
+        """Drain queued messages, stop sender tasks and close the session"""
+        if not self._workers:
+            return
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._session.close()
+        self._session = None
@@ -0,0 +1,107 @@
+#Helper script that feeds many concurrent /start updates through the dispatcher and reports handler latency.
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.filters import Command
+
+from database import AsyncDatabase, Database
+
+bot = Bot(token="123456:benchmark")
+
+def make_update(update_id: int, user_id: int) -> dict:
+    """Build a private-chat /start message update"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+def make_dispatcher(db, api_latency: float, blocking: bool) -> Dispatcher:
+    """Dispatcher with a handler shaped like main.cmd_start; the Telegram API call is a sleep"""
+    dp = Dispatcher()
+
+    @dp.message(Command("start"))
+    async def cmd_start(message: types.Message):
+        user_id = message.from_user.id
+        if blocking:
+            # Как до AsyncDatabase: запросы к SQLite прямо в цикле событий
+            status = db.get_user_status(user_id)
+            if status.is_authorized:
+                db.update_last_login(user_id)
+        else:
+            status = await db.get_user_status(user_id)
+            if status.is_authorized:
+                await db.update_last_login(user_id)
+        await asyncio.sleep(api_latency)
+
+    return dp
+
+async def load(dp: Dispatcher, total: int, concurrency: int, users: int) -> tuple:
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for update_id in counter:
+            started = time.perf_counter()
+            await dp.feed_raw_update(bot, make_update(update_id, 100000 + update_id % users))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+def report(label: str, latencies: list, elapsed: float):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3
+    print(f"{label:<9} {len(latencies) / elapsed:7.0f} updates/s  "
+          f"mean {statistics.fmean(latencies) * 1e3:6.1f}ms  p50 {p50:6.1f}ms  p99 {p99:6.1f}ms")
+
+def seed(db_file: str, users: int):
+    """Create the users; every second one has completed registration"""
+    db = Database(db_file)
+    for user_id in range(100000, 100000 + users):
+        db.create_user(user_id)
+        if user_id % 2:
+            db.complete_registration(user_id)
+    db.close()
+
+async def run(total: int, concurrency: int, users: int, api_latency: float, modes: list):
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, 'load.db')
+        seed(db_file, users)
+        for mode in modes:
+            if mode == 'blocking':
+                db = Database(db_file)
+            else:
+                db = AsyncDatabase(db_file)
+            dp = make_dispatcher(db, api_latency, mode == 'blocking')
+            latencies, elapsed = await load(dp, total, concurrency, users)
+            report(mode, latencies, elapsed)
+            if mode == 'blocking':
+                db.close()
+            else:
+                await db.close()
+    await bot.session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure /start handler latency under concurrent updates")
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--api-latency', type=float, default=0.05, help="seconds per simulated Telegram API call")
+    parser.add_argument('--modes', nargs='+', choices=['async', 'blocking'], default=['blocking', 'async'])
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.concurrency, args.users, args.api_latency, args.modes))
@@ -0,0 +1,198 @@
+#Tests for the verification delivery queue: leasing, shard filter, retries with backoff, failure and retention.
+
+import asyncio
+import time
+
+import pytest
+
+from database import AsyncDatabase, Database
+from delivery import CHANNEL_EMAIL, CHANNEL_SMS, DeliveryService
+from sharding import shard_for
+
+NOW = 1_000_000.0
+LEASE = 300.0
+
+class FakeVerification:
+    """Senders that return queued results (True when the queue is empty) and record every call"""
+
+    def __init__(self, *results: bool):
+        self.results = list(results)
+        self.calls = []
+
+    async def _send(self, contact: str, code: str) -> bool:
+        self.calls.append((contact, code))
+        return self.results.pop(0) if self.results else True
+
+    send_email_code = send_sms_code = _send
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'delivery.db'))
+    yield database
+    database.close()
+
+def queue(db: Database, telegram_id: int, contact: str = 'user@example.com', channel: str = CHANNEL_EMAIL,
+          now: float = NOW) -> int:
+    return db.store_verification_code(telegram_id, contact, '123456', channel, now, now + 600)
+
+def row(db: Database, telegram_id: int = 1):
+    with db._cursor() as c:
+        c.execute('SELECT status, attempts, code, next_attempt_at FROM verification_deliveries WHERE telegram_id = ?',
+                  (telegram_id,))
+        return c.fetchone()
+
+def test_claim_leases_due_deliveries(db):
+    queue(db, 1)
+    claimed = db.claim_due_deliveries(CHANNEL_EMAIL, NOW, LEASE, 10)
+    assert [(d.telegram_id, d.contact, d.code, d.attempts) for d in claimed] == [(1, 'user@example.com', '123456', 0)]
+    assert row(db)[:2] == ('sending', 0)
+
+    # Пока аренда действует, запись не выдается повторно; после истечения - выдается
+    assert db.claim_due_deliveries(CHANNEL_EMAIL, NOW + LEASE - 1, LEASE, 10) == []
+    assert db.next_delivery_due_at(CHANNEL_EMAIL) == NOW + LEASE
+    assert [d.delivery_id for d in db.claim_due_deliveries(CHANNEL_EMAIL, NOW + LEASE, LEASE, 10)] == \
+        [claimed[0].delivery_id]
+
+def test_claim_respects_channel_limit_and_due_time(db):
+    for telegram_id in range(1, 4):
+        queue(db, telegram_id, now=NOW + telegram_id)
+    queue(db, 4, contact='+79991234567', channel=CHANNEL_SMS)
+
+    assert db.claim_due_deliveries(CHANNEL_EMAIL, NOW, LEASE, 10) == []
+    # Раньше срок - раньше в выдаче
+    assert [d.telegram_id for d in db.claim_due_deliveries(CHANNEL_EMAIL, NOW + 10, LEASE, 2)] == [1, 2]
+    assert [d.telegram_id for d in db.claim_due_deliveries(CHANNEL_SMS, NOW + 10, LEASE, 10)] == [4]
+
+@pytest.mark.parametrize('shard_count', [2, 3])
+def test_claim_filters_by_shard(db, shard_count):
+    # Отрицательные id - групповые чаты; остаток должен совпадать с % в Python
+    telegram_ids = [1, 2, 3, 4, 5, 6, -1, -5, -100123]
+    for telegram_id in telegram_ids:
+        queue(db, telegram_id)
+
+    claimed = {}
+    for shard_index in range(shard_count):
+        assert db.next_delivery_due_at(CHANNEL_EMAIL, shard_index, shard_count) == NOW
+        for delivery in db.claim_due_deliveries(CHANNEL_EMAIL, NOW, LEASE, 100, shard_index, shard_count):
+            claimed[delivery.telegram_id] = shard_index
+    assert claimed == {telegram_id: shard_for(telegram_id, shard_count) for telegram_id in telegram_ids}
+
+def test_retry_and_finish_states(db):
+    queue(db, 1)
+    queue(db, 2)
+    first, second = db.claim_due_deliveries(CHANNEL_EMAIL, NOW, LEASE, 10)
+
+    db.retry_delivery(first.delivery_id, NOW + 5, 'send failed')
+    assert row(db, 1) == ('pending', 1, '123456', NOW + 5)
+    db.complete_delivery(first.delivery_id)
+    assert row(db, 1)[:3] == ('sent', 2, None)
+
+    db.fail_delivery(second.delivery_id, 'send failed')
+    assert row(db, 2)[:3] == ('failed', 1, None)
+    assert db.next_delivery_due_at(CHANNEL_EMAIL) is None
+
+def test_delete_finished_deliveries_keeps_unfinished_and_recent(db):
+    for telegram_id in range(1, 6):
+        queue(db, telegram_id)
+    deliveries = db.claim_due_deliveries(CHANNEL_EMAIL, NOW, LEASE, 10)
+    for delivery in deliveries[:2]:
+        db.complete_delivery(delivery.delivery_id)
+    db.fail_delivery(deliveries[2].delivery_id, 'send failed')
+    db.retry_delivery(deliveries[3].delivery_id, NOW + 5000, 'send failed')
+    # Аренда пятой истекла, и она выдается снова вместе с шестой - завершаем только шестую
+    queue(db, 6, now=NOW + 1000)
+    latest = db.claim_due_deliveries(CHANNEL_EMAIL, NOW + 1000, LEASE, 10)
+    db.complete_delivery(next(d.delivery_id for d in latest if d.telegram_id == 6))
+
+    # Завершенные строки хранят конец аренды: NOW + LEASE для первых трех
+    assert db.delete_finished_deliveries(NOW + LEASE - 1, 10) == 0
+    assert db.delete_finished_deliveries(NOW + LEASE, 2) == 2
+    assert db.delete_finished_deliveries(NOW + LEASE, 2) == 1
+    assert [row(db, telegram_id)[0] for telegram_id in range(4, 7)] == ['pending', 'sending', 'sent']
+
+def test_backoff_grows_and_is_capped():
+    service = DeliveryService(None, FakeVerification(), base_delay=2.0, max_delay=10.0)
+    for attempts, full in [(1, 2.0), (2, 4.0), (3, 8.0), (4, 10.0), (10, 10.0)]:
+        for _ in range(20):
+            assert full / 2 <= service._backoff(attempts) <= full
+
+def run_with_service(tmp_path, verification, scenario, **options):
+    async def run():
+        db = AsyncDatabase(str(tmp_path / 'service.db'))
+        service = DeliveryService(db, verification, **options)
+        try:
+            return await scenario(db, service)
+        finally:
+            await service.close()
+            await db.close()
+    return asyncio.run(run())
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.01)
+
+def test_service_retries_until_sent(tmp_path):
+    verification = FakeVerification(False, False, True)
+
+    async def scenario(db, service):
+        service.start()
+        assert await service.send_code(1, 'user@example.com', '123456', time.time() + 600)
+        await wait_for(lambda: service.sent == 1)
+        return service.stats(), await db._run(row, db._db)
+
+    stats, (status, attempts, code, _) = run_with_service(tmp_path, verification, scenario, base_delay=0.01)
+    assert verification.calls == [('user@example.com', '123456')] * 3
+    assert stats == {'sent': 1, 'retried': 2, 'failed': 0, 'deduplicated': 0}
+    assert (status, attempts, code) == ('sent', 3, None)
+
+def test_service_fails_after_max_attempts(tmp_path):
+    verification = FakeVerification(False, False, False, False)
+    failed_users = []
+
+    async def on_failed(telegram_id: int):
+        failed_users.append(telegram_id)
+
+    async def scenario(db, service):
+        service.start()
+        await service.send_code(7, '+79991234567', '123456', time.time() + 600)
+        # Повторное нажатие при живом коде не ставит вторую отправку
+        assert not await service.send_code(7, '+79991234567', '654321', time.time() + 600)
+        await wait_for(lambda: failed_users)
+        return service.stats(), await db._run(row, db._db, 7)
+
+    stats, (status, attempts, code, _) = run_with_service(
+        tmp_path, verification, scenario, on_failed=on_failed, max_attempts=3, base_delay=0.01
+    )
+    assert failed_users == [7]
+    assert len(verification.calls) == 3
+    assert stats == {'sent': 0, 'retried': 2, 'failed': 1, 'deduplicated': 1}
+    assert (status, attempts, code) == ('failed', 3, None)
+
+def test_service_sends_only_own_shard(tmp_path):
+    verification = FakeVerification()
+
+    async def scenario(db, service):
+        service.start(shard_index=1, shard_count=2)
+        for telegram_id in (1, 2, 3, 4):
+            await service.send_code(telegram_id, f'user{telegram_id}@example.com', '123456', time.time() + 600)
+        await wait_for(lambda: service.sent == 2)
+        await asyncio.sleep(0.05)
+        return service.sent
+
+    assert run_with_service(tmp_path, verification, scenario) == 2
+    assert sorted(contact for contact, _ in verification.calls) == ['user1@example.com', 'user3@example.com']
+
+def test_sweep_deletes_old_finished_deliveries(tmp_path):
+    async def scenario(db, service):
+        db.delivery_retention = 0.0
+        await db.store_verification_code(1, 'user@example.com', '123456', CHANNEL_EMAIL, 0.0, 1.0)
+        await db.store_verification_code(2, 'user@example.com', '123456', CHANNEL_EMAIL, 0.0, float('inf'))
+        first, second = await db.claim_due_deliveries(CHANNEL_EMAIL, 0.0, 1.0, 10)
+        await db.complete_delivery(first.delivery_id)
+        return await db.sweep_expired_codes(), db.finished_deliveries_deleted, await db._run(row, db._db, 2)
+
+    codes, deliveries, pending = run_with_service(tmp_path, FakeVerification(), scenario)
+    assert (codes, deliveries) == (1, 1)
+    assert pending[0] == 'sending'
@@ -0,0 +1,124 @@
+#Tests for email domain checks against StaticResolver and for the TTL-bound domain verdict cache.
+
+import asyncio
+import sqlite3
+import time
+
+import dns.exception
+
+from email_check import (DOMAIN_CACHE_MAX_TTL, DOMAIN_CACHE_MIN_TTL, DomainCache, StaticResolver,
+                         check_domain, is_valid_email)
+
+NEGATIVE_TTL = 123.0
+
+def check(records, **options):
+    resolver = StaticResolver(records, **{key: options.pop(key) for key in ('delay', 'ttl') if key in options})
+    return asyncio.run(check_domain('mail.example.org', resolver, negative_ttl=NEGATIVE_TTL, **options))
+
+def test_valid_domain():
+    assert check({
+        ('mail.example.org', 'MX'): ['10 mx.mail.example.org.'],
+        ('mail.example.org', 'A'): ['192.0.2.1'],
+    }, ttl=600) == (True, "", 600)
+
+def test_aaaa_is_enough():
+    is_valid, _, _ = check({
+        ('mail.example.org', 'MX'): ['10 mx.mail.example.org.'],
+        ('mail.example.org', 'AAAA'): ['2001:db8::1'],
+    })
+    assert is_valid
+
+def test_nxdomain_is_negative():
+    assert check({}) == (False, "Домен email не существует", NEGATIVE_TTL)
+
+def test_no_mx_answer_is_negative():
+    assert check({('mail.example.org', 'A'): ['192.0.2.1']}) == \
+        (False, "Домен email не настроен корректно", NEGATIVE_TTL)
+
+def test_empty_mx_is_negative():
+    # Пустой ответ StaticResolver отдает как NoAnswer, так же как dnspython
+    assert check({('mail.example.org', 'MX'): [], ('mail.example.org', 'A'): ['192.0.2.1']}) == \
+        (False, "Домен email не настроен корректно", NEGATIVE_TTL)
+
+def test_mx_without_address_is_negative():
+    assert check({('mail.example.org', 'MX'): ['10 mx.mail.example.org.']}) == \
+        (False, "Домен не существует (нет A или AAAA записей)", NEGATIVE_TTL)
+
+def test_timeout_is_not_cacheable():
+    records = {('mail.example.org', 'MX'): ['10 mx.mail.example.org.'], ('mail.example.org', 'A'): ['192.0.2.1']}
+    is_valid, error, ttl = check(records, delay=0.2, timeout=0.01)
+    assert (is_valid, ttl) == (False, None)
+    assert "превышено время ожидания" in error
+
+    # Таймаут самого резолвера dnspython - тоже не вердикт о домене
+    is_valid, error, ttl = check({**records, ('mail.example.org', 'A'): dns.exception.Timeout()})
+    assert (is_valid, ttl) == (False, None)
+    assert "превышено время ожидания" in error
+
+def test_ttl_is_clamped():
+    records = {('mail.example.org', 'MX'): ['10 mx.mail.example.org.'], ('mail.example.org', 'A'): ['192.0.2.1']}
+    assert check(records, ttl=5)[2] == DOMAIN_CACHE_MIN_TTL
+    assert check(records, ttl=DOMAIN_CACHE_MAX_TTL * 2)[2] == DOMAIN_CACHE_MAX_TTL
+    assert check(records, ttl=3600)[2] == 3600
+
+def test_is_valid_email_caches_verdicts_but_not_timeouts():
+    cache = DomainCache(negative_ttl=NEGATIVE_TTL)
+    resolver = StaticResolver({
+        ('good.example.org', 'MX'): ['10 mx.good.example.org.'],
+        ('good.example.org', 'A'): ['192.0.2.1'],
+        ('slow.example.org', 'MX'): dns.exception.Timeout(),
+    })
+
+    async def run():
+        results = []
+        for email in ('a@good.example.org', 'b@good.example.org', 'a@missing.example.org',
+                      'b@missing.example.org', 'a@slow.example.org', 'b@slow.example.org'):
+            results.append(await is_valid_email(email, resolver, cache=cache))
+        return results
+
+    results = asyncio.run(run())
+    assert [is_valid for is_valid, _ in results] == [True, True, False, False, False, False]
+    queried = [domain for domain, rdtype in resolver.queries if rdtype == 'MX']
+    # Положительный и отрицательный вердикты взяты из кэша, таймаут проверяется заново
+    assert queried == ['good.example.org', 'missing.example.org', 'slow.example.org', 'slow.example.org']
+    assert cache.get('slow.example.org') is None
+    assert cache.stats()['hits'] == 2
+
+def test_domain_cache_expires_entries():
+    cache = DomainCache()
+    cache.set('short.example.org', (True, ""), ttl=0.05)
+    cache.set('long.example.org', (True, ""), ttl=60)
+    assert cache.get('short.example.org') == (True, "")
+    time.sleep(0.1)
+    assert cache.get('short.example.org') is None
+    assert cache.get('long.example.org') == (True, "")
+
+def test_domain_cache_persists_unexpired_verdicts(tmp_path):
+    db_file = str(tmp_path / 'domains.db')
+    cache = DomainCache(db_file=db_file)
+    cache.set('good.example.org', (True, ""), ttl=60)
+    cache.set('bad.example.org', (False, "Домен email не существует"), ttl=60)
+    cache.set('stale.example.org', (True, ""), ttl=0.05)
+    cache.close()
+    time.sleep(0.1)
+
+    warmed = DomainCache(db_file=db_file)
+    try:
+        assert warmed.get('good.example.org') == (True, "")
+        assert warmed.get('bad.example.org') == (False, "Домен email не существует")
+        assert warmed.get('stale.example.org') is None
+    finally:
+        warmed.close()
+
+    # Истекшие строки удаляются при открытии
+    with sqlite3.connect(db_file) as conn:
+        domains = {domain for domain, in conn.execute('SELECT domain FROM email_domains')}
+    assert domains == {'good.example.org', 'bad.example.org'}
+
+def test_domain_cache_stats_hit_ratio():
+    cache = DomainCache()
+    cache.set('good.example.org', (True, ""), ttl=60)
+    cache.get('good.example.org')
+    cache.get('other.example.org')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
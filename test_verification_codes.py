@@ -0,0 +1,121 @@
+#Tests for the verification code store: attempts, expiry, reuse of a live code and the expiry sweeper.
+
+import asyncio
+
+import pytest
+
+from database import CODE_EXHAUSTED, CODE_EXPIRED, CODE_INVALID, CODE_OK, AsyncDatabase, Database
+
+MAX_ATTEMPTS = 5
+NOW = 1_000_000.0
+TTL = 600.0
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'codes.db'))
+    yield database
+    database.close()
+
+def store(db: Database, code: str, contact: str = 'user@example.com', now: float = NOW, telegram_id: int = 1):
+    return db.store_verification_code(telegram_id, contact, code, 'email', now, now + TTL)
+
+def deliveries(db: Database, telegram_id: int = 1):
+    with db._cursor() as c:
+        c.execute('SELECT generation, contact, code FROM verification_deliveries WHERE telegram_id = ? ORDER BY generation',
+                  (telegram_id,))
+        return c.fetchall()
+
+def test_correct_code_is_accepted(db):
+    store(db, '123456')
+    assert db.check_verification_code(1, '123456', NOW + 1, MAX_ATTEMPTS) == (CODE_OK, MAX_ATTEMPTS)
+
+def test_wrong_code_five_times_then_exhausted(db):
+    store(db, '123456')
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        assert db.check_verification_code(1, '000000', NOW + 1, MAX_ATTEMPTS) == (CODE_INVALID, MAX_ATTEMPTS - attempt)
+
+    # Шестая попытка - исчерпано, даже с правильным кодом, и дальше так же
+    assert db.check_verification_code(1, '123456', NOW + 1, MAX_ATTEMPTS).status == CODE_EXHAUSTED
+    assert db.check_verification_code(1, '000000', NOW + 1, MAX_ATTEMPTS).status == CODE_EXHAUSTED
+
+def test_expired_code_does_not_count_an_attempt(db):
+    store(db, '123456')
+    assert db.check_verification_code(1, '000000', NOW + 1, MAX_ATTEMPTS) == (CODE_INVALID, MAX_ATTEMPTS - 1)
+
+    expired = NOW + TTL
+    assert db.check_verification_code(1, '000000', expired, MAX_ATTEMPTS) == (CODE_EXPIRED, MAX_ATTEMPTS - 1)
+    assert db.check_verification_code(1, '123456', expired, MAX_ATTEMPTS) == (CODE_EXPIRED, MAX_ATTEMPTS - 1)
+
+def test_missing_code_is_expired(db):
+    assert db.check_verification_code(1, '123456', NOW, MAX_ATTEMPTS) == (CODE_EXPIRED, 0)
+
+    store(db, '123456')
+    db.delete_verification_code(1)
+    assert db.check_verification_code(1, '123456', NOW + 1, MAX_ATTEMPTS) == (CODE_EXPIRED, 0)
+
+def test_live_code_for_same_contact_is_reused(db):
+    assert store(db, '111111') == 1
+    assert store(db, '222222', now=NOW + 10) is None
+
+    # Действует первый код, и в очереди только он
+    assert db.check_verification_code(1, '222222', NOW + 20, MAX_ATTEMPTS).status == CODE_INVALID
+    assert db.check_verification_code(1, '111111', NOW + 20, MAX_ATTEMPTS).status == CODE_OK
+    assert deliveries(db) == [(1, 'user@example.com', '111111')]
+
+def test_reuse_keeps_attempts(db):
+    store(db, '111111')
+    db.check_verification_code(1, '000000', NOW + 1, MAX_ATTEMPTS)
+    assert store(db, '222222', now=NOW + 2) is None
+    assert db.check_verification_code(1, '111111', NOW + 3, MAX_ATTEMPTS) == (CODE_OK, MAX_ATTEMPTS - 1)
+
+def test_new_generation_after_expiry(db):
+    assert store(db, '111111') == 1
+    db.check_verification_code(1, '000000', NOW + 1, MAX_ATTEMPTS)
+
+    assert store(db, '222222', now=NOW + TTL) == 2
+    # Новый код со сброшенным счетчиком попыток
+    assert db.check_verification_code(1, '222222', NOW + TTL + 1, MAX_ATTEMPTS) == (CODE_OK, MAX_ATTEMPTS)
+    assert [generation for generation, _, _ in deliveries(db)] == [1, 2]
+
+def test_new_generation_after_contact_change(db):
+    assert store(db, '111111') == 1
+    assert store(db, '222222', contact='+79991234567', now=NOW + 10) == 2
+
+    assert db.check_verification_code(1, '111111', NOW + 20, MAX_ATTEMPTS).status == CODE_INVALID
+    assert db.check_verification_code(1, '222222', NOW + 20, MAX_ATTEMPTS).status == CODE_OK
+    assert deliveries(db) == [(1, 'user@example.com', '111111'), (2, '+79991234567', '222222')]
+
+def test_generation_continues_after_code_is_deleted(db):
+    assert store(db, '111111') == 1
+    db.delete_verification_code(1)
+    # Поколение берется из очереди отправки, а не из удаленной строки кода
+    assert store(db, '222222', now=NOW + 1) == 2
+
+def test_codes_of_different_users_are_independent(db):
+    assert store(db, '111111', telegram_id=1) == 1
+    assert store(db, '222222', telegram_id=2) == 1
+    assert db.check_verification_code(1, '222222', NOW + 1, MAX_ATTEMPTS).status == CODE_INVALID
+    assert db.check_verification_code(2, '222222', NOW + 1, MAX_ATTEMPTS).status == CODE_OK
+
+def test_delete_expired_codes_in_batches(db):
+    for telegram_id in range(1, 8):
+        store(db, '111111', telegram_id=telegram_id, now=NOW - TTL)
+    for telegram_id in range(8, 10):
+        store(db, '111111', telegram_id=telegram_id)
+
+    assert [db.delete_expired_codes(NOW, 3) for _ in range(4)] == [3, 3, 1, 0]
+    for telegram_id in range(8, 10):
+        assert db.check_verification_code(telegram_id, '111111', NOW + 1, MAX_ATTEMPTS).status == CODE_OK
+
+def test_sweep_expired_codes_runs_until_a_short_batch(tmp_path):
+    async def run():
+        db = AsyncDatabase(str(tmp_path / 'codes.db'), code_sweep_batch_size=3)
+        try:
+            for telegram_id in range(1, 8):
+                await db.store_verification_code(telegram_id, 'user@example.com', '111111', 'email', 0.0, 1.0)
+            await db.store_verification_code(8, 'user@example.com', '111111', 'email', 0.0, float('inf'))
+            return await db.sweep_expired_codes(), db.expired_codes_deleted
+        finally:
+            await db.close()
+
+    assert asyncio.run(run()) == (7, 7)
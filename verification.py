@@ -1,11 +1,10 @@
 #Secondary bot file which is responsible for sending emails with confirmation code, checking this code, and so on.
 
-import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from twilio.rest import Client
-import phonenumbers
+import secrets
+from metrics import PROVIDER_LATENCY, observe_latency
+from email_transport import AsyncEmailSender, SMTPPool, build_text_message
+from sms_transport import SMSSender
+from phone import normalize_and_classify_phone
 
 class Verification:
     def __init__(self):
@@ -22,23 +21,44 @@ class Verification:
         self.twilio_auth_token = ""
         self.twilio_phone_number = ""  # В формате +1234567890
         
+        # Пул SMTP-соединений открывается лениво, при первой отправке
+        self.email_sender = AsyncEmailSender(SMTPPool(
+            self.smtp_server,
+            self.smtp_port,
+            self.smtp_username,
+            self.smtp_password
+        ))
+        
+        # Один HTTP-клиент Twilio с очередью исходящих SMS
+        self.sms_sender = SMSSender(
+            self.twilio_account_sid,
+            self.twilio_auth_token,
+            self.twilio_phone_number
+        )
+        
+    def start_background_tasks(self):
+        """Start keepalive of pooled transport connections on the running loop"""
+        self.email_sender.start_background_tasks()
+        self.sms_sender.start()
+    
+    async def close(self):
+        """Wait for pending sends and close transport connections"""
+        await self.email_sender.close()
+        await self.sms_sender.close()
+        
     def generate_code(self) -> str:
         """Generate a 6-digit verification code"""
-        return ''.join(random.choices('0123456789', k=6))
+        # secrets, а не random: код не должен угадываться по предыдущим
+        return f'{secrets.randbelow(10 ** 6):06d}'
     
-    def send_email_code(self, email: str, code: str) -> bool:
+    @observe_latency(PROVIDER_LATENCY, 'email')
+    async def send_email_code(self, email: str, code: str) -> bool:
         """Send verification code via email"""
         try:
             if self.smtp_username == "your.email@gmail.com":
                 print("ERROR: Please configure your Gmail credentials in verification.py")
                 return False
 
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.smtp_username
-            msg['To'] = email
-            msg['Subject'] = "Код подтверждения"
-            
             body = f"""
             Здравствуйте!
             
@@ -49,55 +69,36 @@ class Verification:
             С уважением,
             Ваш бот
             """
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Connect to SMTP server
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_username, self.smtp_password)
-            
-            # Send email
-            server.send_message(msg)
-            server.quit()
+            # Create message
+            msg = build_text_message(self.smtp_username, email, "Код подтверждения", body)
             
-            return True
+            # Send email through the pooled connection
+            return await self.email_sender.send(msg)
             
         except Exception as e:
             print(f"Error sending email: {e}")
             return False
     
-    def send_sms_code(self, phone: str, code: str) -> bool:
+    @observe_latency(PROVIDER_LATENCY, 'sms')
+    async def send_sms_code(self, phone: str, code: str) -> bool:
         """Send verification code via SMS"""
         try:
             if self.twilio_account_sid == "your_account_sid":
                 print("ERROR: Please configure your Twilio credentials in verification.py")
                 return False
                 
-            # Нормализуем номер телефона
-            if not phone.startswith('+'):
-                if phone.startswith('38'):
-                    phone = '+' + phone
-                else:
-                    phone = '+38' + phone
-            
-            # Проверяем формат номера
-            parsed_number = phonenumbers.parse(phone)
-            if not phonenumbers.is_valid_number(parsed_number):
+            # Номер уже разобран при вводе контакта - результат берется из кэша
+            phone_info = normalize_and_classify_phone(phone)
+            if not phone_info.is_valid:
                 print("Error: Invalid phone number format")
                 return False
             
-            # Инициализируем клиент Twilio
-            client = Client(self.twilio_account_sid, self.twilio_auth_token)
-            
-            # Отправляем SMS
-            message = client.messages.create(
-                body=f"Ваш код подтверждения: {code}\n\nНикому не сообщайте этот код!",
-                from_=self.twilio_phone_number,
-                to=phone
+            # Ставим SMS в очередь и ждем результата, не блокируя цикл событий
+            return await self.sms_sender.submit(
+                phone_info.e164,
+                f"Ваш код подтверждения: {code}\n\nНикому не сообщайте этот код!"
             )
             
-            return True
-            
         except Exception as e:
             print(f"Error sending SMS: {e}")
             return False 
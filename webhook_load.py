@@ -0,0 +1,61 @@
+#Helper script that POSTs synthetic Telegram updates to a running webhook server to measure its throughput.
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+def make_update(update_id: int, user_id: int) -> dict:
+    """Build a minimal private-chat /start message update"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+async def run(url: str, secret: str, total: int, concurrency: int, users: int):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        for update_id in counter:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=make_update(update_id, 100000 + update_id % users),
+                                        headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"updates: {total}, errors: {errors}, elapsed: {elapsed:.2f}s, throughput: {total / elapsed:.0f} updates/s")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="POST synthetic /start updates to a webhook endpoint")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.secret, args.updates, args.concurrency, args.users))